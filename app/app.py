@@ -1,5 +1,7 @@
 import argparse
+import gzip
 import logging
+import os
 import socket
 
 import dash_bootstrap_components as dbc
@@ -13,9 +15,11 @@ from dash import (
     html,
     page_container,
 )
-from flask import Flask
+from flask import Flask, request
 
 from components import header
+from pages.composites import composites
+from pages.downloads import downloads
 from pages.ui import make_loader
 
 
@@ -42,9 +46,78 @@ config = {
     "CACHE_TYPE": "FileSystemCache",
     "CACHE_DEFAULT_TIMEOUT": 31536000,  # arbitrarily long cache time
     "CACHE_DIR": "cache",
+    # number of entries kept before the oldest are removed
+    "CACHE_THRESHOLD": int(os.getenv("CACHE_THRESHOLD", 500)),
 }
 server.config.from_mapping(config)
 
+# Response compression setup
+compression_config = {
+    "COMPRESS_LEVEL": int(os.getenv("COMPRESS_LEVEL", 6)),
+    # responses smaller than this many bytes are sent as they are
+    "COMPRESS_MIN_SIZE": int(os.getenv("COMPRESS_MIN_SIZE", 500)),
+    "COMPRESS_MIMETYPES": os.getenv(
+        "COMPRESS_MIMETYPES", "application/json,text/html"
+    ).split(","),
+}
+server.config.from_mapping(compression_config)
+
+# File downloads
+server.register_blueprint(downloads)
+# Scientific image channel composites
+server.register_blueprint(composites)
+
+
+@server.after_request
+def compress_response(response):
+    """Compresses callback, layout, and page responses for browsers that accept it"""
+    if (
+        response.direct_passthrough
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in server.config["COMPRESS_MIMETYPES"]
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    data = response.get_data()
+    if (
+        request.accept_encodings.quality("gzip") <= 0
+        or len(data) < server.config["COMPRESS_MIN_SIZE"]
+    ):
+        return response
+
+    data = gzip.compress(data, compresslevel=server.config["COMPRESS_LEVEL"])
+    response.set_data(data)
+    response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+@server.cli.command("warm-cache")
+def warm_cache():
+    """
+    Builds the 3D model figures ahead of the first visit. Run from the app folder after publishing new models:
+
+        flask --app app:server warm-cache
+    """
+    from pages.model3d import warm_mesh_figs
+
+    count = warm_mesh_figs()
+    print(f"Cached 3D model figures for {count} organs")
+
+
+@server.after_request
+def cache_versioned_assets(response):
+    """Lets browsers keep assets requested with a version, such as scientific image display copies, for a year"""
+    if (
+        response.status_code == 200
+        and request.path.startswith("/assets/")
+        and "v" in request.args
+    ):
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
 
 def serve_layout():
     return html.Div(
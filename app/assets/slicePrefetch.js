@@ -0,0 +1,39 @@
+// images of recently shown and prefetched slices, least recently used first
+const sliceCache = new Map();
+
+function cacheSlice(url, limit) {
+    let img = sliceCache.get(url);
+    if (img) {
+        sliceCache.delete(url);
+    } else {
+        img = new Image();
+        img.src = url;
+    }
+    sliceCache.set(url, img);
+    while (sliceCache.size > limit) {
+        sliceCache.delete(sliceCache.keys().next().value);
+    }
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    slices: {
+        // Shows a slice of the active channel and loads the slices around it, so stepping through the stack does not
+        // wait for the server
+        showSlice: function (value, slices) {
+            if (!value || !slices || !slices.urls[value - 1]) {
+                return window.dash_clientside.no_update;
+            }
+            const urls = slices.urls;
+            // the nearest slices are cached last so they are the last to be evicted
+            for (let distance = slices.prefetch; distance > 0; distance--) {
+                for (const index of [value - 1 + distance, value - 1 - distance]) {
+                    if (index >= 0 && index < urls.length) {
+                        cacheSlice(urls[index], slices.cache);
+                    }
+                }
+            }
+            cacheSlice(urls[value - 1], slices.cache);
+            return urls[value - 1];
+        }
+    }
+});
@@ -0,0 +1,74 @@
+// OpenSeadragon is loaded the first time the zoomable view is turned on, not with every page
+let tileViewerScript = null;
+
+function loadTileViewer(url) {
+    if (typeof OpenSeadragon !== "undefined") {
+        return Promise.resolve();
+    }
+    if (!tileViewerScript) {
+        tileViewerScript = new Promise(function (resolve, reject) {
+            const script = document.createElement("script");
+            script.src = url;
+            script.onload = resolve;
+            script.onerror = function () {
+                // allow another attempt the next time the view is turned on
+                tileViewerScript = null;
+                script.remove();
+                reject(new Error(`Could not load ${url}`));
+            };
+            document.head.appendChild(script);
+        });
+    }
+    return tileViewerScript;
+}
+
+function hideTiles() {
+    if (window.tileViewer) {
+        window.tileViewer.destroy();
+        window.tileViewer = null;
+    }
+    return {"display": "none"};
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    tiles: {
+        // Shows the tile pyramid of the current slice in an OpenSeadragon viewer, keeping the zoom when the slice changes
+        showTiles: async function (source, enabled) {
+            if (!enabled || !source) {
+                return hideTiles();
+            }
+            try {
+                await loadTileViewer(source.script);
+            } catch (err) {
+                console.error(err);
+                return hideTiles();
+            }
+            const container = document.getElementById("si-tile-viewer");
+            if (!container) {
+                return hideTiles();
+            }
+            // images without a tile pyramid are shown whole
+            const tiles = source.type === "image" ? {type: "image", url: source.url} : source.url;
+            const viewer = window.tileViewer;
+            if (viewer && viewer.element === container) {
+                const bounds = viewer.viewport.getBounds();
+                viewer.addOnceHandler("open", function () {
+                    viewer.viewport.fitBounds(bounds, true);
+                });
+                viewer.open(tiles);
+            } else {
+                if (viewer) {
+                    viewer.destroy();
+                }
+                window.tileViewer = OpenSeadragon({
+                    element: container,
+                    prefixUrl: source.prefix,
+                    tileSources: tiles,
+                    showNavigator: true,
+                    maxZoomPixelRatio: 2,
+                });
+            }
+            return {"display": "block"};
+        }
+    }
+});
@@ -0,0 +1,46 @@
+import io
+import logging
+import numpy as np
+from flask import Blueprint, abort, make_response, request
+from PIL import Image
+
+app_logger = logging.getLogger(__name__)
+gunicorn_logger = logging.getLogger("gunicorn.error")
+app_logger.handlers = gunicorn_logger.handlers
+app_logger.setLevel(gunicorn_logger.level)
+
+# registered on the server in app.py
+composites = Blueprint("composites", __name__)
+
+
+@composites.route("/scientific-images-composite/<iset>/<int:slider>")
+def composite_image(iset, slider):
+    """
+    Sends a slice of an image set with the channels in the c parameter blended together. The color and gain parameters
+    give each channel's color, as a hex code without the #, and gain.
+    """
+    # the scientific image page registers itself with the Dash app, so it is imported once the app exists
+    from pages.ocpage import composite_channels, composite_files, read_channel
+
+    try:
+        channels = [int(c) for c in request.args["c"].split(",")]
+        colors = [f"#{color}" for color in request.args["color"].split(",")]
+        gains = [float(gain) for gain in request.args["gain"].split(",")]
+        if not len(channels) == len(colors) == len(gains):
+            raise ValueError("Expected a color and gain for each channel")
+        files = composite_files(iset, slider, channels)
+        arrays = [read_channel(str(f), f.stat().st_mtime_ns) for f in files]
+        pixels = composite_channels(np.stack(arrays), colors, gains)
+    except (KeyError, ValueError) as err:
+        app_logger.debug(f"Could not make composite of {iset} slice {slider}: {err}")
+        abort(404)
+
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    response = make_response(buffer.getvalue())
+    response.mimetype = "image/jpeg"
+    if "v" in request.args:
+        # the URL changes when the channel images are republished
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+    return response
@@ -1,3 +1,5 @@
+import os
+
 FILE_DESTINATION = {
     "si-block": {
         "block-data": "/home/nonroot/app/assets/config/blocks.csv",
@@ -16,3 +18,43 @@ FILE_DESTINATION = {
     "title": {"publish": "/home/nonroot/app/assets/config/labels.csv"},
     "reports": {"publish": "/home/nonroot/app/assets/config/reports.csv"},
 }
+
+# Memory budget, in bytes, for the parsed volumetric map data each worker keeps in memory
+DATASET_CACHE_MAX_BYTES = int(os.getenv("DATASET_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Number of rendered volumetric map figures kept in the shared figure cache
+FIGURE_CACHE_MAX_ENTRIES = int(os.getenv("FIGURE_CACHE_MAX_ENTRIES", 500))
+
+# Vertex budget for the point and cube views of a whole block. Larger blocks are shown at a reduced level of detail
+# until a single layer or full resolution is selected.
+VOLUMETRIC_MAP_MAX_VERTICES = int(os.getenv("VOLUMETRIC_MAP_MAX_VERTICES", 500000))
+
+# Encoding of volumetric map figures sent to the browser: "binary" sends arrays as base64 typed arrays, "json" sends
+# plain JSON numbers
+FIGURE_ENCODING = os.getenv("FIGURE_ENCODING", "binary")
+
+# Level of detail of the 3D organ models shown by default: 0 is the full mesh, 1 and up are the simplified meshes
+# written when the models were published
+MODEL_DETAIL_LEVEL = int(os.getenv("MODEL_DETAIL_LEVEL", 1))
+
+# Number of threads each worker uses to read the .npz mesh files of an organ
+MODEL_LOAD_WORKERS = int(os.getenv("MODEL_LOAD_WORKERS", 4))
+
+# Location of the OpenSeadragon build used by the zoomable scientific image view. It is only loaded when a user turns
+# the zoomable view on. On closed networks, point this at a copy served by nginx or another internal host.
+TILE_VIEWER_URL = os.getenv(
+    "TILE_VIEWER_URL",
+    "https://cdn.jsdelivr.net/npm/openseadragon@4.1.1/build/openseadragon/",
+)
+
+# Number of slices on each side of the current one that the scientific image viewer loads ahead, and the number of
+# slice images it keeps in the browser
+SLICE_PREFETCH = int(os.getenv("SLICE_PREFETCH", 5))
+SLICE_CACHE_SIZE = int(os.getenv("SLICE_CACHE_SIZE", 50))
+
+# Number of channel images of scientific image slices that each worker keeps in memory for composites
+COMPOSITE_CACHE_SLICES = int(os.getenv("COMPOSITE_CACHE_SLICES", 64))
+
+# Internal nginx location that serves the published configuration folder. When set, downloads are handed to nginx with
+# X-Accel-Redirect instead of being streamed by the app.
+DOWNLOAD_ACCEL_PREFIX = os.getenv("DOWNLOAD_ACCEL_PREFIX", "")
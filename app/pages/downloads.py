@@ -0,0 +1,62 @@
+import logging
+import pandas as pd
+from pathlib import Path
+from flask import Blueprint, abort, make_response, send_file
+from pages.constants import DOWNLOAD_ACCEL_PREFIX, FILE_DESTINATION as FD
+
+app_logger = logging.getLogger(__name__)
+gunicorn_logger = logging.getLogger("gunicorn.error")
+app_logger.handlers = gunicorn_logger.handlers
+app_logger.setLevel(gunicorn_logger.level)
+
+# registered on the server in app.py
+downloads = Blueprint("downloads", __name__, url_prefix="/download")
+
+# published configuration folder, the folder blocks.csv is published to
+CONFIG_DIR = Path(FD["si-block"]["block-data"]).parent
+
+
+def send_published_file(file: Path):
+    """
+    Sends a published file as a download without reading it into memory. Flask streams the file from disk and answers
+    conditional and Range requests, so browsers can resume interrupted downloads. If DOWNLOAD_ACCEL_PREFIX is set, nginx
+    is asked to send the file instead, from that internal location mapped to the published configuration folder.
+    """
+    if not file.is_file():
+        abort(404)
+    app_logger.debug(f"Sending {file}")
+    if DOWNLOAD_ACCEL_PREFIX:
+        response = make_response("")
+        response.headers["X-Accel-Redirect"] = (
+            f"{DOWNLOAD_ACCEL_PREFIX.rstrip('/')}/{file.resolve().relative_to(CONFIG_DIR.resolve()).as_posix()}"
+        )
+        response.headers["Content-Disposition"] = f'attachment; filename="{file.name}"'
+        return response
+    return send_file(file, as_attachment=True, conditional=True, etag=True)
+
+
+@downloads.route("/scientific-images/<iset>")
+def download_scientific_image(iset):
+    """Sends the original file of an image set"""
+    s_imgs = pd.read_csv(FD["si-block"]["si-files"])
+    img = s_imgs.loc[s_imgs["Image Set"] == iset]
+    if img.empty:
+        abort(404)
+    row = img.iloc[0]
+    basefile = row["File"][0 : row["File"].rfind(".")]
+    return send_published_file(
+        Path(f"{FD['sci-images']}/{row['Tissue Block']}/{basefile}/{row['File']}")
+    )
+
+
+@downloads.route("/volumetric-map/<int:index>")
+def download_volumetric_map_data(index):
+    """Sends the file in a row of the volumetric map downloads list"""
+    try:
+        downloads = pd.read_csv(f"{FD['volumetric-map']}/downloads.csv")
+        row = downloads.loc[index]
+    except (FileNotFoundError, KeyError):
+        abort(404)
+    return send_published_file(
+        Path(f"{FD['volumetric-map']}/{row['Block']}/{row['Name']}")
+    )
@@ -1,9 +1,13 @@
+import hashlib
 import logging
 import json
+import time
 import dash_bootstrap_components as dbc
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from dash import (
     Input,
     Output,
@@ -16,8 +20,12 @@ from dash import (
     callback_context,
 )
 from pywavefront import Wavefront
-from pages.constants import FILE_DESTINATION as FD
-from pages.ui import make_tabs
+from pages.constants import (
+    FILE_DESTINATION as FD,
+    MODEL_DETAIL_LEVEL,
+    MODEL_LOAD_WORKERS,
+)
+from pages.ui import file_signature, make_tabs
 from pages.home import cache
 
 
@@ -29,58 +37,92 @@ app_logger.handlers = gunicorn_logger.handlers
 app_logger.setLevel(gunicorn_logger.level)
 
 
-def get_blocks():
-    return pd.read_csv(FD["si-block"]["block-data"])
-
-
-def filter_blocks(curve_number) -> tuple[str, pd.DataFrame]:
-    blocks = get_blocks()
-    row = blocks.loc[blocks["Tissue Block"] == curve_number]
-    if not row.empty:
-        block_name = row.iloc[0]["Tissue Block"]
-    else:
-        block_name = ""
-    return block_name, row
-
-
-def get_organs() -> list:
-    # Get organ ID's
+def build_model_index() -> dict:
+    """
+    Reads obj-files.csv and the block data and indexes them for the page's callbacks:
+        organ_descs: description of each organ, in the order of the organ tabs
+        organ_traces: names of the traces of each organ, in the order they are added to the organ's graph
+        traces: Dataframe of the traces of each organ, indexed by trace number
+        blocks: Dataframe of the rows for each tissue block, keyed by block name
+    """
     traces = pd.read_csv(f"{FD["obj-files"]["summary"]}/obj-files.csv")
-    blocks = get_blocks()
+    blocks = pd.read_csv(FD["si-block"]["block-data"])
     organs = list(traces["Organ"].unique())
     organ_descs = []
     organ_traces = []
+    organ_trace_data = []
 
-    # Get organ descriptions and trace name
-    for i in range(len(organs)):
-        desc_block = blocks.loc[blocks["Organ ID"] == organs[i]]
+    # Get organ descriptions and traces
+    for organ in organs:
+        desc_block = blocks.loc[blocks["Organ ID"] == organ]
         if desc_block.empty:
-            desc = organs[i]
+            desc = organ
         else:
             desc = desc_block["Organ Description"].unique()[0]
         organ_descs.append(desc)
-        this_organ = traces.loc[traces["Organ"] == organs[i]].copy()
+        this_organ = traces.loc[traces["Organ"] == organ].copy()
+        this_organ.index = pd.Index([x for x in range(this_organ.shape[0])])
         organ_traces.append(this_organ["Name"].to_list())
+        organ_trace_data.append(this_organ)
+
+    return {
+        "organ_descs": organ_descs,
+        "organ_traces": organ_traces,
+        "traces": organ_trace_data,
+        "blocks": {
+            name: row for name, row in blocks.groupby("Tissue Block", sort=False)
+        },
+        "no_block": blocks.iloc[0:0],
+    }
 
-    return organ_descs, organ_traces
 
+model_index = {"signature": None}
 
-def get_trace(idx) -> tuple[list, list]:
+
+def get_model_index() -> dict:
     """
-    Splits organ data into a separate Dataframe for each organ. This is necessary because when the traces are added to
-    separate graphs per organ, Dash will restart the indexing for the traces for each graph. Since the trace index is
-    the only way to identify the trace in the click data, the trace indexing needs to match in the graph and in the
-    Dataframe that will be used to populate the Block Data panel.
+    Returns the index of the published models, rebuilding it only when obj-files.csv or the block data has changed
+    """
+    files = [
+        f"{FD["obj-files"]["summary"]}/obj-files.csv",
+        FD["si-block"]["block-data"],
+    ]
+    signature = file_signature(files)
+    global model_index
+    if model_index["signature"] != signature:
+        index = build_model_index()
+        index["signature"] = signature
+        index["version"] = hashlib.sha1(repr(signature).encode()).hexdigest()
+        model_index = index
+        app_logger.debug(f"Indexed 3D models for {len(index["organ_descs"])} organs")
+    return model_index
 
-    Returns organs, organ traces
+
+def filter_blocks(curve_number) -> tuple[str, pd.DataFrame]:
+    index = get_model_index()
+    row = index["blocks"].get(curve_number, index["no_block"])
+    if not row.empty:
+        block_name = row.iloc[0]["Tissue Block"]
+    else:
+        block_name = ""
+    return block_name, row
+
+
+def get_organs() -> list:
+    index = get_model_index()
+    return index["organ_descs"], index["organ_traces"]
+
+
+def get_trace(idx) -> tuple[list, list]:
     """
-    traces = pd.read_csv(f"{FD["obj-files"]["summary"]}/obj-files.csv")
+    Returns the traces of one organ. This is necessary because when the traces are added to separate graphs per organ,
+    Dash will restart the indexing for the traces for each graph. Since the trace index is the only way to identify the
+    trace in the click data, the trace indexing needs to match in the graph and in the Dataframe that will be used to
+    populate the Block Data panel.
 
-    # split data by organ for later access
-    organs = list(traces["Organ"].unique())
-    this_organ = traces.loc[traces["Organ"] == organs[idx]].copy()
-    this_organ.index = pd.Index([x for x in range(this_organ.shape[0])])
-    return this_organ
+    Returns organ traces
+    """
+    return get_model_index()["traces"][idx]
 
 
 def check_null(value):
@@ -90,8 +132,32 @@ def check_null(value):
         return value
 
 
-def read_obj(file: str) -> tuple[np.array, np.array]:
-    """Reads an obj file at the given location and returns the vertices and faces of the object represented by the obj file."""
+def has_mesh_file(file: str) -> bool:
+    """Returns True if the .npz mesh file written when the obj file was published exists and is up to date"""
+    mesh_file = Path(file).with_suffix(".npz")
+    try:
+        return mesh_file.stat().st_mtime_ns >= Path(file).stat().st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def read_obj(file: str, level=0) -> tuple[np.array, np.array]:
+    """Reads an obj file at the given location and returns the vertices and faces of the object represented by the obj file.
+    Uses the .npz mesh file written when the obj file was published if it is up to date. Level 0 is the full mesh, higher
+    levels are the simplified meshes in the mesh file; the most detailed level up to the given one is returned."""
+    mesh_file = Path(file).with_suffix(".npz")
+    if has_mesh_file(file):
+        with np.load(mesh_file, allow_pickle=False) as mesh:
+            while level > 0 and f"faces_{level}" not in mesh.files:
+                level -= 1
+            suffix = f"_{level}" if level > 0 else ""
+            matrix_vertices = mesh[f"vertices{suffix}"]
+            faces = mesh[f"faces{suffix}"]
+        app_logger.debug(
+            f"Read {mesh_file} and found vertices ndarray of shape {matrix_vertices.shape} and faces ndarray of shape {faces.shape}"
+        )
+        return matrix_vertices, faces
+
     organ = Wavefront(file, collect_faces=True)
     matrix_vertices = np.array(organ.vertices)
     faces = np.array(organ.mesh_list[0].faces)
@@ -152,12 +218,19 @@ def make_mesh_settings(
 
 
 def make_mesh_data(
-    name: str, file: str, color=None, opacity=1, x_map="x", y_map="y", z_map="z"
+    name: str,
+    file: str,
+    color=None,
+    opacity=1,
+    x_map="x",
+    y_map="y",
+    z_map="z",
+    level=0,
 ) -> object:
     """
-    Reads an obj file and populates a 3d mesh object.
+    Reads an obj file at the given level of detail and populates a 3d mesh object.
     """
-    vertices, faces = read_obj(file)
+    vertices, faces = read_obj(file, level)
     data = make_mesh_settings(
         vertices,
         faces,
@@ -172,46 +245,77 @@ def make_mesh_data(
     return data
 
 
+def models_version() -> str:
+    """
+    Returns a digest of obj-files.csv and the block data, taken when the model index was built. Publishing 3D models
+    rewrites obj-files.csv, so the version changes whenever the models are republished.
+    """
+    return get_model_index()["version"]
+
+
+def load_mesh(trace: pd.Series, level: int) -> object:
+    """Reads the obj file of a trace and populates its 3d mesh object. Returns None if the file is missing."""
+    file_loc = f"{FD["obj-files"]["volumes"]}/{trace["File"]}"
+    start = time.perf_counter()
+    try:
+        data = make_mesh_data(
+            trace["Name"],
+            file_loc,
+            trace["Color"],
+            trace["Opacity"],
+            trace["x axis"],
+            trace["y axis"],
+            trace["z axis"],
+            level,
+        )
+    except FileNotFoundError:
+        app_logger.debug(f"Could not find {file_loc}")
+        return None
+    app_logger.debug(f"Loaded {file_loc} in {time.perf_counter() - start:.3f} s")
+    return data
+
+
+def make_mesh_fig(idx=0, level=MODEL_DETAIL_LEVEL) -> go.Figure:
+    """Plots the objects described in an obj in a Plotly Dash figure, at the given level of detail"""
+    return render_mesh_fig(idx, level, models_version())
+
+
 @cache.memoize()
-def make_mesh_fig(idx=0) -> go.Figure:
-    """Plots the objects described in an obj in a Plotly Dash figure"""
+def render_mesh_fig(idx: int, level: int, version: str) -> go.Figure:
+    """
+    Builds the figure for make_mesh_fig. The version of the published models is part of the cache key, so figures are
+    rebuilt after the models are republished and figures of older versions age out of the cache.
+    """
     organ_trace = get_trace(idx)
     if organ_trace.shape[0] == 0:
         return
-    start = True
-    for i in organ_trace.index:
-        try:
-            file_loc = f"{FD["obj-files"]["volumes"]}/{organ_trace.at[i, "File"]}"
+    traces = [organ_trace.loc[i] for i in organ_trace.index]
+    # Mesh files are read concurrently, as NumPy releases the GIL while reading them. Parsing an obj file with
+    # pywavefront is pure Python and holds the GIL, so obj files without a mesh file are read one at a time. The
+    # traces stay in order so that click data can be matched to them.
+    with ThreadPoolExecutor(max_workers=MODEL_LOAD_WORKERS) as executor:
+        loads = [
+            executor.submit(load_mesh, trace, level)
+            if has_mesh_file(f"{FD["obj-files"]["volumes"]}/{trace["File"]}")
+            else None
+            for trace in traces
+        ]
+        meshes = (
+            load.result() if load is not None else load_mesh(trace, level)
+            for load, trace in zip(loads, traces)
+        )
+        start = True
+        for data in meshes:
+            if data is None:
+                # try to add the other traces
+                continue
             if start:
-                data1 = make_mesh_data(
-                    organ_trace.at[i, "Name"],
-                    file_loc,
-                    organ_trace.at[i, "Color"],
-                    organ_trace.at[i, "Opacity"],
-                    organ_trace.at[i, "x axis"],
-                    organ_trace.at[i, "y axis"],
-                    organ_trace.at[i, "z axis"],
-                )
-                fig = go.Figure(data1)
-                name = data1[0]["name"]
-                app_logger.debug(f"Added trace for {name} to 3D Model of organ {idx}")
+                fig = go.Figure(data)
                 start = False
             else:
-                data = make_mesh_data(
-                    organ_trace.at[i, "Name"],
-                    file_loc,
-                    organ_trace.at[i, "Color"],
-                    organ_trace.at[i, "Opacity"],
-                    organ_trace.at[i, "x axis"],
-                    organ_trace.at[i, "y axis"],
-                    organ_trace.at[i, "z axis"],
-                )
                 fig.add_trace(go.Mesh3d(data[0]))
-                name = data[0]["name"]
-                app_logger.debug(f"Added trace for {name} to 3D Model of organ {idx}")
-        except FileNotFoundError:
-            # try to add the other traces
-            continue
+            name = data[0]["name"]
+            app_logger.debug(f"Added trace for {name} to 3D Model of organ {idx}")
     try:
         fig.update_layout(
             scene_aspectmode="data",
@@ -229,17 +333,38 @@ def make_mesh_fig(idx=0) -> go.Figure:
         return False
 
 
+def warm_mesh_figs() -> int:
+    """Builds the figures of every organ at the default and full levels of detail. Returns the number of organs."""
+    organ_descs, organ_traces = get_organs()
+    for idx in range(len(organ_descs)):
+        for level in sorted({0, MODEL_DETAIL_LEVEL}):
+            make_mesh_fig(idx, level)
+            app_logger.debug(
+                f"Cached 3D Model of organ {idx} at level of detail {level}"
+            )
+    return len(organ_descs)
+
+
 def make_graph_layout(organ=1, idx=0) -> html.Section:
     fig = make_mesh_fig(idx)
     if not fig:
         card_content = "No models could be loaded for this organ"
     else:
-        card_content = dcc.Graph(
-            id={"type": "organ-graph", "index": idx},
-            figure=fig,
-            config={"scrollZoom": False},
-            className="centered-graph",
-        )
+        card_content = [
+            dcc.Graph(
+                id={"type": "organ-graph", "index": idx},
+                figure=fig,
+                config={"scrollZoom": False},
+                className="centered-graph",
+            ),
+            dbc.CardFooter(
+                dbc.Switch(
+                    id={"type": "detail-switch", "index": idx},
+                    label="Full detail",
+                    value=MODEL_DETAIL_LEVEL == 0,
+                )
+            ),
+        ]
     data = [
         dbc.Row(dbc.Col(html.Header(html.H2(f"3D Model of {organ}")))),
         dbc.Row(
@@ -350,6 +475,19 @@ def display_click_data(click_data, organ_traces):
         return blank_card_content
 
 
+@callback(
+    Output({"type": "organ-graph", "index": MATCH}, "figure"),
+    Input({"type": "detail-switch", "index": MATCH}, "value"),
+    prevent_initial_call=True,
+)
+def update_detail(full_detail):
+    """Redraws an organ's models at full detail or at the default level of detail"""
+    idx = int(callback_context.triggered_id["index"])
+    level = 0 if full_detail else MODEL_DETAIL_LEVEL
+    app_logger.debug(f"Showing 3D Model of organ {idx} at level of detail {level}")
+    return make_mesh_fig(idx, level)
+
+
 @callback(
     Output("model-fig", "children"),
     Input("model-tabs", "active_tab"),
@@ -1,15 +1,50 @@
 import logging
 import dash_bootstrap_components as dbc
+import numpy as np
 import pandas as pd
-from dash import Input, Output, State, callback, dcc, html, no_update, register_page
-from PIL import Image
-from pages.constants import FILE_DESTINATION as FD
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlencode
+from dash import (
+    ALL,
+    ClientsideFunction,
+    Input,
+    Output,
+    State,
+    callback,
+    clientside_callback,
+    dcc,
+    get_asset_url,
+    get_relative_path,
+    html,
+    no_update,
+    register_page,
+)
+from PIL import Image, ImageColor
+from pages.constants import (
+    COMPOSITE_CACHE_SLICES,
+    FILE_DESTINATION as FD,
+    SLICE_CACHE_SIZE,
+    SLICE_PREFETCH,
+    TILE_VIEWER_URL,
+)
 
 app_logger = logging.getLogger(__name__)
 gunicorn_logger = logging.getLogger("gunicorn.error")
 app_logger.handlers = gunicorn_logger.handlers
 app_logger.setLevel(gunicorn_logger.level)
 
+# colors offered for each channel of a composite, the channels start with the colors in this order
+CHANNEL_COLORS = {
+    "Red": "#ff0000",
+    "Green": "#00ff00",
+    "Blue": "#0000ff",
+    "Magenta": "#ff00ff",
+    "Cyan": "#00ffff",
+    "Yellow": "#ffff00",
+    "Gray": "#ffffff",
+}
+
 
 def get_img(iset: str) -> pd.DataFrame:
     s_imgs = pd.read_csv(FD["si-block"]["si-files"])
@@ -36,6 +71,187 @@ register_page(
 )
 
 
+def image_asset(folder: str, file: str) -> str | None:
+    """
+    Returns the location, relative to the assets folder, of the display copy of a scientific image written when it was
+    published, or of the image itself if there is no display copy. Returns None if neither exists.
+    """
+    stem = Path(file).stem
+    candidates = [f"{folder}/display/{stem}.webp", f"{folder}/display/{stem}.jpg"]
+    for asset in candidates + [f"{folder}/{file}"]:
+        if Path(f"assets/{asset}").exists():
+            return asset
+    return None
+
+
+def image_url(folder: str, file: str) -> str:
+    """
+    Returns the URL of the image shown for a scientific image, see image_asset. The URL includes the file's
+    modification time, so browsers can keep the image until it is republished.
+    """
+    asset = image_asset(folder, file)
+    if asset is None:
+        return get_asset_url(f"{folder}/{file}")
+    return f"{get_asset_url(asset)}?v={Path(f"assets/{asset}").stat().st_mtime_ns}"
+
+
+@lru_cache(maxsize=COMPOSITE_CACHE_SLICES)
+def read_channel(file: str, version: int) -> np.ndarray:
+    """
+    Reads a channel image as a uint8 intensity array. The version is the file's modification time, so that republished
+    images are read again.
+    """
+    with Image.open(file) as img:
+        if img.mode in ("I", "I;16", "F"):
+            # scale 16 bit and float images to 8 bits
+            pixels = np.asarray(img, dtype=np.float32)
+            return (pixels * 255 / max(pixels.max(), 1)).astype(np.uint8)
+        return np.asarray(img.convert("L"))
+
+
+def composite_channels(
+    channels: np.ndarray, colors: list[str], gains: list[float]
+) -> np.ndarray:
+    """
+    Blends a (channel, height, width) array of uint8 intensities into an RGB image. Each channel is tinted with its
+    color, scaled by its gain, and added to the others.
+    """
+    rgb = np.array([ImageColor.getrgb(color) for color in colors], dtype=np.float32)
+    weights = rgb * np.asarray(gains, dtype=np.float32)[:, None] / 255
+    blended = np.einsum(
+        "chw,ck->hwk", channels, weights, dtype=np.float32, optimize=True
+    )
+    return np.clip(blended, 0, 255).astype(np.uint8)
+
+
+def tile_source(folder: str, file: str) -> dict | None:
+    """
+    Returns the tile pyramid of a scientific image for the zoomable view. Images without a pyramid written at publish
+    are shown as a single image instead. Returns None if the image does not exist.
+    """
+    asset = f"{folder}/tiles/{Path(file).stem}.dzi"
+    path = Path(f"assets/{asset}")
+    if path.exists():
+        source = {
+            "type": "dzi",
+            "url": f"{get_asset_url(asset)}?v={path.stat().st_mtime_ns}",
+        }
+    elif image_asset(folder, file) is not None:
+        source = {"type": "image", "url": image_url(folder, file)}
+    else:
+        return None
+    source["prefix"] = f"{TILE_VIEWER_URL}images/"
+    source["script"] = f"{TILE_VIEWER_URL}openseadragon.min.js"
+    return source
+
+
+def has_tiles(folder: str) -> bool:
+    """Returns True if tile pyramids were written for any of the images in a folder at publish"""
+    return any(Path(f"assets/{folder}/tiles").glob("*.dzi"))
+
+
+def slice_image(tab, slider, data) -> tuple[str, str]:
+    """Returns the folder, relative to the assets folder, and the name of the image for a channel tab and slice"""
+    if not slider:
+        val_str = "0000"
+    else:
+        val = slider - 1
+        val_str = f"{val:04}"
+
+    if not tab:
+        c = 0
+    else:
+        c = int(tab[-1]) - 1
+
+    folder = f"config/scientific-images/{data['block']}/{data['basefile']}"
+    if data["file"][-3:] == "jpg":
+        return folder, data["file"]
+    else:
+        return folder, f"{data['basefile']}_C{c}{val_str}.png"
+
+
+def make_tile_viewer():
+    return dbc.Card(
+        [
+            dbc.CardHeader(
+                dbc.Switch(id="tile-switch", label="Zoomable view", value=False)
+            ),
+            dbc.CardBody(
+                html.Div(
+                    id="si-tile-viewer",
+                    className="tile-viewer",
+                    style={"display": "none"},
+                )
+            ),
+        ],
+        class_name="slicer-card",
+    )
+
+
+def make_composite_controls(channels: int):
+    rows = []
+    for c in range(channels):
+        rows.append(
+            dbc.Row(
+                [
+                    dbc.Col(
+                        dbc.Checkbox(
+                            id={"type": "composite-channel", "index": c},
+                            label=f"Channel {c + 1}",
+                            value=True,
+                        ),
+                        width=2,
+                    ),
+                    dbc.Col(
+                        dbc.Select(
+                            id={"type": "composite-color", "index": c},
+                            options=[
+                                {"label": name, "value": value}
+                                for name, value in CHANNEL_COLORS.items()
+                            ],
+                            value=list(CHANNEL_COLORS.values())[
+                                c % len(CHANNEL_COLORS)
+                            ],
+                        ),
+                        width=2,
+                    ),
+                    dbc.Col(
+                        dcc.Slider(
+                            0,
+                            2,
+                            0.1,
+                            value=1,
+                            marks={0: "0", 1: "1", 2: "2"},
+                            id={"type": "composite-gain", "index": c},
+                        ),
+                        width=8,
+                    ),
+                ],
+                align="center",
+                className="g-3",
+            )
+        )
+    rows.append(
+        html.Div(
+            html.Img(id="si-composite-img", className="custom-slicer-img"),
+            id="si-composite-output",
+            className="custom-slicer-div",
+            style={"display": "none"},
+        )
+    )
+    return dbc.Card(
+        [
+            dbc.CardHeader(
+                dbc.Switch(
+                    id="composite-switch", label="Composite channels", value=False
+                )
+            ),
+            dbc.CardBody(rows),
+        ],
+        class_name="slicer-card",
+    )
+
+
 def make_tab_content(slider=False, points=0, channels=1):
     card_content = []
     body_content = [
@@ -79,7 +295,7 @@ def make_tab_content(slider=False, points=0, channels=1):
     return dbc.Card(card_content, class_name="slicer-card")
 
 
-def make_download_section(filename):
+def make_download_section(filename, iset):
     return html.Div(
         children=[
             html.H2("Download original file", className="download-header"),
@@ -88,26 +304,22 @@ def make_download_section(filename):
                 dbc.Button(
                     "Download",
                     id="btn-download-si",
+                    href=get_relative_path(f"/download/scientific-images/{iset}"),
+                    external_link=True,
                 ),
                 className="download-button-container",
             ),
-            dcc.Download(id="download-si"),
         ],
         style={"min-height": 155},
     )
 
 
-def layout(iset=None, **kwargs):
-    # handle bad image set values
-    img = get_img(iset)
-    if img.empty:
-        return html.Div(html.P("Invalid image set requested"))
-
+def make_img_dict(img: pd.DataFrame) -> dict:
     ext_pos = img.at[img.index[0], "File"].rfind(".")
     basefile = img.at[img.index[0], "File"][0:ext_pos]
 
     # flatten dict since there is only one row
-    img_dict = {
+    return {
         "block": img.at[img.index[0], "Tissue Block"],
         "iset": img.at[img.index[0], "Image Set"],
         "cat": img.at[img.index[0], "Image Category"],
@@ -119,23 +331,42 @@ def layout(iset=None, **kwargs):
         "width": img.at[img.index[0], "Width"],
     }
 
+
+def layout(iset=None, **kwargs):
+    # handle bad image set values
+    img = get_img(iset)
+    if img.empty:
+        return html.Div(html.P("Invalid image set requested"))
+
+    img_dict = make_img_dict(img)
+    viewer = [
+        html.H2(f"{img_dict['iset']} {img_dict['cat']}"),
+        make_tab_content(
+            (img_dict["slices"] > 1),
+            img_dict["slices"],
+            img_dict["channels"],
+        ),
+    ]
+    # the zoomable view is offered when tile pyramids were written for the images at publish
+    if has_tiles(slice_image(None, None, img_dict)[0]):
+        viewer.append(make_tile_viewer())
+    if img_dict["channels"] > 1 and img_dict["file"][-3:] != "jpg":
+        viewer.append(make_composite_controls(img_dict["channels"]))
+
     return html.Div(
         [
             html.Section(
-                [
-                    html.H2(f"{img_dict['iset']} {img_dict['cat']}"),
-                    make_tab_content(
-                        (img_dict["slices"] > 1),
-                        img_dict["slices"],
-                        img_dict["channels"],
-                    ),
+                viewer
+                + [
                     dcc.Store(id="si-slider-store"),
                     dcc.Store(id="si-file-store", data=img_dict),
+                    dcc.Store(id="si-tile-source"),
+                    dcc.Store(id="si-slice-store"),
                 ]
             ),
             html.Section(
                 [
-                    make_download_section(img_dict["file"]),
+                    make_download_section(img_dict["file"], img_dict["iset"]),
                     html.Hr(),
                 ]
             ),
@@ -151,33 +382,16 @@ def save_slider_pos(value):
 @callback(
     Output("si-slider-output", "children"),
     Input("tabs", "active_tab"),
-    Input("si-slider-store", "data"),
+    State("si-slider-store", "data"),
     State("si-file-store", "data"),
 )
 def update_pic(tab, slider, data):
     # callbacks must be included in the page even though not all layouts need them
     # no_update supresses the callback if not needed for this path
+    # moving the slider changes the image in the browser, see assets/slicePrefetch.js
     if not tab and not slider:
         return no_update
-    elif not slider:
-        val_str = "0000"
-    else:
-        val = slider - 1
-        val_str = f"{val:04}"
-
-    if not tab:
-        c = 0
-    else:
-        c = int(tab[-1]) - 1
-
-    if data["file"][-3:] == "jpg":
-        pic = Image.open(
-            f"assets/config/scientific-images/{data['block']}/{data['basefile']}/{data["file"]}"
-        )
-    else:
-        pic = Image.open(
-            f"assets/config/scientific-images/{data['block']}/{data['basefile']}/{data['basefile']}_C{c}{val_str}.png"
-        )
+    src = image_url(*slice_image(tab, slider, data))
     # add max-height and max-width to style based on image's dimensions
     if int(data["height"]) > 600:
         ar = int(data["width"]) / int(data["height"])
@@ -188,20 +402,106 @@ def update_pic(tab, slider, data):
         max_width = int(data["width"])
 
     return html.Img(
-        src=pic,
+        id="si-slice-img",
+        src=src,
         className="custom-slicer-img solo-slicer-img",
         style={"max-height": max_height, "max-width": max_width},
     )
 
 
 @callback(
-    Output("download-si", "data"),
-    Input("btn-download-si", "n_clicks"),
+    Output("si-slice-store", "data"),
+    Input("tabs", "active_tab"),
+    State("si-file-store", "data"),
+)
+def update_slice_urls(tab, data):
+    """Sends the URLs of the slices of the active channel, and how many the browser should load ahead and keep"""
+    if int(data["slices"]) <= 1:
+        return no_update
+    urls = [
+        image_url(*slice_image(tab, slider, data))
+        for slider in range(1, int(data["slices"]) + 1)
+    ]
+    return {"urls": urls, "prefetch": SLICE_PREFETCH, "cache": SLICE_CACHE_SIZE}
+
+
+clientside_callback(
+    ClientsideFunction(namespace="slices", function_name="showSlice"),
+    Output("si-slice-img", "src"),
+    Input("si-slider", "value"),
+    State("si-slice-store", "data"),
+)
+
+
+@callback(
+    Output("si-tile-source", "data"),
+    Input("tabs", "active_tab"),
+    Input("si-slider-store", "data"),
+    State("si-file-store", "data"),
+)
+def update_tile_source(tab, slider, data):
+    if not tab and not slider:
+        return no_update
+    return tile_source(*slice_image(tab, slider, data))
+
+
+clientside_callback(
+    ClientsideFunction(namespace="tiles", function_name="showTiles"),
+    Output("si-tile-viewer", "style"),
+    Input("si-tile-source", "data"),
+    Input("tile-switch", "value"),
+)
+
+
+def composite_files(iset: str, slider: int, channels: list[int]) -> list[Path]:
+    """
+    Returns the images of the given channels of a slice of an image set. Raises ValueError if the image set, slice, or a
+    channel does not exist.
+    """
+    img = get_img(iset)
+    if img.empty:
+        raise ValueError(f"Unknown image set {iset}")
+    data = make_img_dict(img)
+    if not 1 <= slider <= max(int(data["slices"]), 1) or not channels:
+        raise ValueError(f"Slice {slider} of {iset} does not exist")
+    files = []
+    for c in channels:
+        if not 0 <= c < int(data["channels"]):
+            raise ValueError(f"Channel {c} of {iset} does not exist")
+        asset = image_asset(*slice_image(f"channel-{c + 1}", slider, data))
+        if asset is None:
+            raise ValueError(f"Channel {c} of slice {slider} of {iset} does not exist")
+        files.append(Path(f"assets/{asset}"))
+    return files
+
+
+@callback(
+    Output("si-composite-img", "src"),
+    Output("si-composite-output", "style"),
+    Input("composite-switch", "value"),
+    Input("si-slider-store", "data"),
+    Input({"type": "composite-channel", "index": ALL}, "value"),
+    Input({"type": "composite-color", "index": ALL}, "value"),
+    Input({"type": "composite-gain", "index": ALL}, "value"),
     State("si-file-store", "data"),
-    prevent_initial_call=True,
 )
-def download_file(n_clicks, data):
-    app_logger.debug(f"Sending {data['file']}")
-    return dcc.send_file(
-        f"assets/config/scientific-images/{data['block']}/{data['basefile']}/{data['file']}"
+def update_composite(enabled, slider, selected, colors, gains, data):
+    channels = [c for c, on in enumerate(selected) if on]
+    if not enabled or not channels:
+        return no_update, {"display": "none"}
+    slider = slider or 1
+    try:
+        files = composite_files(data["iset"], slider, channels)
+    except ValueError as err:
+        app_logger.debug(f"Could not make composite: {err}")
+        return no_update, {"display": "none"}
+    query = urlencode(
+        {
+            "c": ",".join(str(c) for c in channels),
+            "color": ",".join(colors[c].lstrip("#") for c in channels),
+            "gain": ",".join(str(gains[c]) for c in channels),
+            "v": max(f.stat().st_mtime_ns for f in files),
+        }
     )
+    src = get_relative_path(f"/scientific-images-composite/{data['iset']}/{slider}")
+    return f"{src}?{query}", {"display": "flex"}
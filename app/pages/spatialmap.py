@@ -1,20 +1,36 @@
+import hashlib
+import json
 import logging
+import sys
+import threading
+from collections import OrderedDict
 from dash import (
     Input,
     Output,
     callback,
     dcc,
+    get_app,
     html,
     register_page,
     State,
-    MATCH,
+    Patch,
+    ctx,
     no_update,
 )
+from flask_caching import Cache
 import pandas as pd
 import numpy as np
+import plotly.graph_objects as go
+from plotly.colors import get_colorscale as get_named_colorscale
 from pathlib import Path
-from pages.constants import FILE_DESTINATION as FD
-from components import alerts
+from pages.constants import (
+    FILE_DESTINATION as FD,
+    DATASET_CACHE_MAX_BYTES,
+    FIGURE_CACHE_MAX_ENTRIES,
+    FIGURE_ENCODING,
+    VOLUMETRIC_MAP_MAX_VERTICES,
+)
+from components import alerts, tables
 import pages.ui as ui
 import traceback
 
@@ -38,6 +54,198 @@ register_page(
 )
 
 
+# Dataset cache
+def estimate_size(value) -> int:
+    """Approximates the number of bytes held in memory by a cached value"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    elif isinstance(value, (np.ndarray, ui.VoxelGrid)):
+        return value.nbytes
+    elif isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    else:
+        return sys.getsizeof(value)
+
+
+class DatasetCache:
+    """
+    Per-worker LRU cache of parsed volumetric map data. Each entry records the signature of the files it was built
+    from, so files republished through the configuration portal are reloaded on the next request. Cached values are
+    shared between callbacks and must not be modified by the caller.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, files: list, loader):
+        """Returns the cached value for key if the files are unchanged, otherwise calls loader and caches the result"""
+        signature = ui.file_signature(files)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        value = loader()
+        nbytes = estimate_size(value)
+        with self.lock:
+            self.discard(key)
+            # values larger than the whole budget are returned without being cached
+            if nbytes <= self.max_bytes:
+                self.entries[key] = (signature, value, nbytes)
+                self.size += nbytes
+                while self.size > self.max_bytes:
+                    old_key, old_entry = self.entries.popitem(last=False)
+                    self.size -= old_entry[2]
+                    self.evictions += 1
+                    app_logger.debug(f"Evicted {old_key} from dataset cache")
+        return value
+
+    def discard(self, key: tuple):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+dataset_cache = DatasetCache(DATASET_CACHE_MAX_BYTES)
+
+
+# Rendered figures are kept as JSON in a file system cache shared by all of the workers
+app = get_app()
+figure_cache = Cache(
+    app.server,
+    config={
+        "CACHE_TYPE": "FileSystemCache",
+        "CACHE_DEFAULT_TIMEOUT": 31536000,
+        # a sibling of the main cache directory, which cachelib expects to hold only its own entries
+        "CACHE_DIR": "cache-figures",
+        "CACHE_THRESHOLD": FIGURE_CACHE_MAX_ENTRIES,
+    },
+)
+
+
+def dataset_version(block: str) -> str:
+    """Returns a digest of the files published for a block, which changes whenever the block is republished"""
+    files = [
+        p for p in Path(f"{FD['volumetric-map']}/{block}").rglob("*") if p.is_file()
+    ]
+    for name in ["images.csv", "colorscales.csv"]:
+        p = Path(f"{FD['image-layer']}/{name}")
+        if p.exists():
+            files.append(p)
+    signature = ui.file_signature(sorted(files))
+    return hashlib.sha1(repr(signature).encode()).hexdigest()
+
+
+def figure_key(block: str, *settings) -> str:
+    """Returns the figure cache key for a block's current dataset and a set of render settings"""
+    parts = [block, dataset_version(block), FIGURE_ENCODING, *settings]
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+    return f"volumetric-map-figure/{digest}"
+
+
+def table_file(block: str, name: str) -> Path:
+    """
+    Returns the location of a published table. The binary copy written by the configuration portal is preferred
+    while its manifest shows it was written from the CSV as it is now, and the CSV is used if it has been replaced,
+    for example by hand.
+    """
+    csv = Path(f"{FD['volumetric-map']}/{block}/{name}.csv")
+    npy = csv.with_suffix(".npy")
+    if not csv.exists() or tables.binary_is_current(npy, csv):
+        return npy
+    return csv
+
+
+def read_table(file: Path) -> pd.DataFrame:
+    """Reads a table from a NumPy structured array if the file is a .npy file, or from CSV otherwise"""
+    if file.suffix != ".npy":
+        return pd.read_csv(file)
+    return tables.read_columnar(file)
+
+
+def get_points_data(block: str) -> pd.DataFrame:
+    file = table_file(block, "points_data")
+    return dataset_cache.get(("points", block), [file], lambda: read_table(file))
+
+
+def get_voxel_grid(block: str, axes: dict) -> ui.VoxelGrid:
+    """Returns the points data for a block as a dense grid over its axes"""
+    file = table_file(block, "points_data")
+    measurements_file = f"{FD['volumetric-map']}/{block}/vol_measurements.csv"
+    return dataset_cache.get(
+        ("voxels", block),
+        [file, measurements_file],
+        lambda: ui.VoxelGrid.from_points(get_points_data(block), axes),
+    )
+
+
+def get_display_grid(
+    block: str, axes: dict, tab: str, layer: str, full_resolution=False
+) -> tuple[ui.VoxelGrid, int]:
+    """
+    Returns the grid to draw a view from, and the factor it was downsampled by. Point and cube views of a whole
+    block are downsampled to stay within VOLUMETRIC_MAP_MAX_VERTICES unless full resolution was requested.
+    """
+    grid = get_voxel_grid(block, axes)
+    if full_resolution or layer != "All":
+        return grid, 1
+    if tab == "point-tab":
+        factor = ui.lod_factor(grid, 1, VOLUMETRIC_MAP_MAX_VERTICES, dense=True)
+    elif tab in ["cube-tab", "cube-image-tab"]:
+        factor = ui.lod_factor(grid, 8, VOLUMETRIC_MAP_MAX_VERTICES)
+    else:
+        return grid, 1
+    if factor == 1:
+        return grid, 1
+
+    file = table_file(block, "points_data")
+    measurements_file = f"{FD['volumetric-map']}/{block}/vol_measurements.csv"
+    coarse = dataset_cache.get(
+        ("voxels", block, factor),
+        [file, measurements_file],
+        lambda: grid.downsample(factor),
+    )
+    return coarse, factor
+
+
+def add_lod_note(fig: go.Figure, factor: int) -> go.Figure:
+    """Tells the user when a figure is drawn from a downsampled grid"""
+    if factor > 1:
+        fig.update_layout(
+            title=dict(
+                text=f"Reduced detail: each cell averages up to {factor}×{factor}×{factor} cells. "
+                "Choose a layer or turn on full resolution to see every cell.",
+                font=dict(size=12),
+            )
+        )
+    return fig
+
+
 # Initial data retrieval tasks
 def make_defaults(ranges_df: pd.DataFrame) -> dict:
     defaults = {
@@ -83,21 +291,47 @@ def make_image_layers(df: pd.DataFrame, block) -> dict:
     return layers
 
 
-def get_all_images(block):
-    img_info = ui.get_image_info(block)
+def layer_file(block: str, name: str) -> Path:
+    """Returns the location of a published image layer. Layers published as text files are still supported."""
+    npy = Path(f"{FD["image-layer"]}/{block}/layers/{Path(name).stem}.npy")
+    if npy.exists():
+        return npy
+    return npy.with_suffix(".txt")
+
+
+def read_images(files: list) -> list:
     imgs = []
-    files = list(img_info["Name"])
-    for file in files:
-        fpath = Path(file)
-        fstem = fpath.stem
-        p = Path(f"{FD["image-layer"]}/{block}/layers/{fstem}.txt")
-        img = np.loadtxt(p, delimiter="\t")
+    for p in files:
+        if Path(p).suffix == ".npy":
+            img = np.load(p, mmap_mode="r", allow_pickle=False)
+        else:
+            img = np.loadtxt(p, delimiter="\t")
         imgs.append(img)
+    return imgs
+
+
+def get_all_images(block):
+    img_info = ui.get_image_info(block)
+    files = []
+    for file in list(img_info["Name"]):
+        files.append(layer_file(block, file))
+    imgs = dataset_cache.get(
+        ("image-layers", block),
+        [f"{FD["image-layer"]}/images.csv", *files],
+        lambda: read_images(files),
+    )
     return img_info, imgs
 
 
 def get_colorscale(scale: str) -> list:
-    cs_df = pd.read_csv(f"{FD["image-layer"]}/colorscales.csv")
+    file = f"{FD["image-layer"]}/colorscales.csv"
+    return dataset_cache.get(
+        ("colorscale", scale), [file], lambda: read_colorscale(file, scale)
+    )
+
+
+def read_colorscale(file: str, scale: str) -> list:
+    cs_df = pd.read_csv(file)
     # filter down to just that colorscale
     this_scale = cs_df.loc[cs_df["Scale Name"] == scale]
 
@@ -213,6 +447,7 @@ def layout(block=None, **kwargs):
                     html.Div(id="current-filters"),
                     ui.make_volumetric_map_tab_content(block),
                     dcc.Store(id="value-store"),
+                    dcc.Store(id="figure-style-sm"),
                     dcc.Store(id="color-store-sm"),
                     dcc.Store(id="cube-opacity-store-sm"),
                     dcc.Store(id="point-opacity-store-sm"),
@@ -351,22 +586,6 @@ def update_controls(
             ]
 
 
-@callback(
-    Output("volumetric-map-graph", "figure"),
-    Input("volumetric-tabs", "active_tab"),
-    Input("color-store-sm", "data"),
-    Input("value-store", "data"),
-    Input("cube-opacity-store-sm", "data"),
-    Input("point-opacity-store-sm", "data"),
-    Input("layer-store-sm", "data"),
-    Input("image-layer-selected-sm", "data"),
-    Input("image-opacity-store-sm", "data"),
-    Input("category-selected", "data"),
-    State("category-store", "data"),
-    State("value-range-store", "data"),
-    State("axes-store", "data"),
-    State("block-store", "data"),
-)
 def update_fig(
     tab,
     color="haline",
@@ -381,6 +600,7 @@ def update_fig(
     value_range_dict={},
     axes={},
     block="",
+    full_resolution=False,
 ):
     # Dash overrides the parameter defaults by passing in None sometimes, must reset defaults in that case
     props = {
@@ -416,7 +636,9 @@ def update_fig(
         )
     if tab == "cube-tab":
         try:
-            df = pd.read_csv(f"{FD['volumetric-map']}/{block}/cube_data.csv")
+            grid, factor = get_display_grid(
+                block, axes, tab, settings["layer"], full_resolution
+            )
         except FileNotFoundError:
             app_logger.debug(traceback.print_exc())
             return alerts.send_toast(
@@ -425,20 +647,23 @@ def update_fig(
                 "failure",
             )
 
-        return ui.make_cube_fig(
+        fig = ui.make_cube_fig(
             axes,
             value_ranges,
             category_data,
-            df,
+            grid,
             colorscheme=settings["color"],
             value=settings["value"],
             opacity=settings["cubeopacity"],
             layer=settings["layer"],
             category_opt=settings["category_selected"],
         )
+        return add_lod_note(fig, factor)
     if tab == "cube-image-tab":
         try:
-            df = pd.read_csv(f"{FD['volumetric-map']}/{block}/cube_data.csv")
+            grid, factor = get_display_grid(
+                block, axes, tab, settings["layer"], full_resolution
+            )
         except FileNotFoundError:
             app_logger.debug(traceback.print_exc())
             return alerts.send_toast(
@@ -450,11 +675,11 @@ def update_fig(
         img_info, imgs = get_all_images(block)
         scale = img_info["Colorscale"].unique().tolist()[0]
         colorscale = get_colorscale(scale)
-        return ui.make_cube_image_fig(
+        fig = ui.make_cube_image_fig(
             axes,
             value_ranges,
             category_data,
-            df,
+            grid,
             colorscheme=settings["color"],
             value=settings["value"],
             opacity=settings["cubeopacity"],
@@ -465,10 +690,13 @@ def update_fig(
             imgs=imgs,
             colorscale=colorscale,
         )
+        return add_lod_note(fig, factor)
 
     elif tab == "point-tab":
         try:
-            df = pd.read_csv(f"{FD['volumetric-map']}/{block}/points_data.csv")
+            grid, factor = get_display_grid(
+                block, axes, tab, settings["layer"], full_resolution
+            )
         except FileNotFoundError:
             app_logger.debug(traceback.print_exc())
             return alerts.send_toast(
@@ -476,18 +704,19 @@ def update_fig(
                 "Missing required configuration, please contact an administrator to resolve the issue.",
                 "failure",
             )
-        return ui.make_point_fig(
+        fig = ui.make_point_fig(
             axes,
             value_ranges,
-            df,
+            grid,
             colorscheme=settings["color"],
             value=settings["value"],
             opacity=settings["pointopacity"],
             layer=settings["layer"],
         )
+        return add_lod_note(fig, factor)
     elif tab == "layer-tab":
         try:
-            df = pd.read_csv(f"{FD['volumetric-map']}/{block}/points_data.csv")
+            grid = get_voxel_grid(block, axes)
         except FileNotFoundError:
             app_logger.debug(traceback.print_exc())
             return alerts.send_toast(
@@ -498,7 +727,7 @@ def update_fig(
         return ui.make_layer_fig(
             axes,
             value_ranges,
-            df,
+            grid,
             colorscheme=settings["color"],
             value=settings["value"],
             layer=settings["layer"],
@@ -518,7 +747,7 @@ def update_fig(
         )
     elif tab == "sphere-tab":
         try:
-            df = pd.read_csv(f"{FD['volumetric-map']}/{block}/points_data.csv")
+            grid = get_voxel_grid(block, axes)
         except FileNotFoundError:
             app_logger.debug(traceback.print_exc())
             return alerts.send_toast(
@@ -530,7 +759,7 @@ def update_fig(
             axes,
             value_ranges,
             category_data,
-            df,
+            grid,
             colorscheme=settings["color"],
             value=settings["value"],
             layer=settings["layer"],
@@ -538,24 +767,190 @@ def update_fig(
         )
 
 
+def style_paths(tab: str, data: list) -> dict:
+    """
+    Returns the location of each style setting in a figure's traces, so that restyle_fig can change the style
+    without rebuilding the figure. Each location is a trace index followed by the keys of the property.
+    """
+    paths = {"color": [], "cubeopacity": [], "pointopacity": [], "image_opacity": []}
+    if not data:
+        return paths
+    if tab in ["cube-tab", "cube-image-tab"]:
+        # in the cube + image view only the first trace is cubes, the rest are image layers
+        paths["color"].append([0, "colorscale"])
+        paths["cubeopacity"].append([0, "opacity"])
+    elif tab == "point-tab":
+        paths["color"].append([0, "colorscale"])
+        paths["pointopacity"].append([0, "opacity"])
+    elif tab == "layer-tab":
+        paths["color"].extend([i, "colorscale"] for i in range(len(data)))
+    elif tab == "sphere-tab":
+        if data[0]["type"] == "scatter3d":
+            paths["color"].append([0, "marker", "colorscale"])
+        else:
+            paths["color"].append([0, "colorscale"])
+    elif tab == "image-layer-tab":
+        paths["image_opacity"].extend([i, "opacity"] for i in range(len(data)))
+    return paths
+
+
+def figure_id(
+    tab, value, layer, image_layer, category_selected, block, full_resolution
+) -> list:
+    """Returns the settings that decide which traces a figure has, so that restyle_fig only patches the figure
+    its style paths were taken from"""
+    return [
+        tab,
+        value,
+        layer,
+        image_layer,
+        category_selected,
+        block,
+        bool(full_resolution),
+    ]
+
+
 @callback(
-    Output({"type": "dcc-download", "index": MATCH}, "data"),
-    Input({"type": "btn-download", "index": MATCH}, "n_clicks"),
-    State({"type": "btn-download", "index": MATCH}, "id"),
-    prevent_initial_call=True,
+    Output("volumetric-map-graph", "figure"),
+    Output("figure-style-sm", "data"),
+    Input("volumetric-tabs", "active_tab"),
+    State("color-store-sm", "data"),
+    Input("value-store", "data"),
+    State("cube-opacity-store-sm", "data"),
+    State("point-opacity-store-sm", "data"),
+    Input("layer-store-sm", "data"),
+    Input("image-layer-selected-sm", "data"),
+    State("image-opacity-store-sm", "data"),
+    Input("category-selected", "data"),
+    State("category-store", "data"),
+    State("value-range-store", "data"),
+    State("axes-store", "data"),
+    State("block-store", "data"),
+    Input("fullresswitch", "value"),
 )
-def display_output(n_clicks, id):
+def render_fig(
+    tab,
+    color,
+    value,
+    cubeopacity,
+    pointopacity,
+    layer,
+    image_layer,
+    image_opacity,
+    category_selected,
+    category_data,
+    value_range_dict,
+    axes,
+    block,
+    full_resolution,
+):
+    """
+    Returns the figure for the current settings, using the figure cache if it has been rendered before, and the
+    location of its style settings along with the figure they belong to. Style changes on their own are handled by
+    restyle_fig.
+    """
+    args = [
+        tab,
+        color,
+        value,
+        cubeopacity,
+        pointopacity,
+        layer,
+        image_layer,
+        image_opacity,
+        category_selected,
+        category_data,
+        value_range_dict,
+        axes,
+        block,
+        bool(full_resolution),
+    ]
     try:
-        downloads = pd.read_csv(f"{FD['volumetric-map']}/downloads.csv")
+        key = figure_key(block, *args)
     except FileNotFoundError:
-        app_logger.debug(traceback.print_exc())
-        return alerts.send_toast(
-            "Cannot load page",
-            "Missing required configuration, please contact an administrator to resolve the issue.",
-            "failure",
-        )
-    row = downloads.loc[id["index"]]
-    file_path = Path(f"{FD['volumetric-map']}/{row['Block']}/{row['Name']}")
-    if not Path.exists(file_path):
+        # let update_fig report the missing configuration
+        return update_fig(*args), None
+
+    figure_json = figure_cache.get(key)
+    if figure_json is not None:
+        app_logger.debug(f"Figure cache hit for {block} {tab}")
+    else:
+        fig = update_fig(*args)
+        if not isinstance(fig, go.Figure):
+            return fig, None
+        if FIGURE_ENCODING == "binary":
+            figure_json = ui.encode_figure(fig)
+        else:
+            figure_json = fig.to_json()
+        figure_cache.set(key, figure_json)
+    figure = json.loads(figure_json)
+    style = {
+        "figure": figure_id(
+            tab, value, layer, image_layer, category_selected, block, full_resolution
+        ),
+        "paths": style_paths(tab, figure["data"]),
+    }
+    return figure, style
+
+
+@callback(
+    Output("volumetric-map-graph", "figure", allow_duplicate=True),
+    Input("color-store-sm", "data"),
+    Input("cube-opacity-store-sm", "data"),
+    Input("point-opacity-store-sm", "data"),
+    Input("image-opacity-store-sm", "data"),
+    State("figure-style-sm", "data"),
+    State("volumetric-tabs", "active_tab"),
+    State("value-store", "data"),
+    State("layer-store-sm", "data"),
+    State("image-layer-selected-sm", "data"),
+    State("category-selected", "data"),
+    State("block-store", "data"),
+    State("fullresswitch", "value"),
+    prevent_initial_call=True,
+)
+def restyle_fig(
+    color,
+    cubeopacity,
+    pointopacity,
+    image_opacity,
+    style,
+    tab,
+    value,
+    layer,
+    image_layer,
+    category_selected,
+    block,
+    full_resolution,
+):
+    """
+    Sends only the changed style properties of the current figure. Nothing is sent while the figure on screen is not
+    the one for the current settings, for example during a tab or layer change, as render_fig then draws the figure
+    with the new style.
+    """
+    settings = {
+        "color-store-sm": ("color", color),
+        "cube-opacity-store-sm": ("cubeopacity", cubeopacity),
+        "point-opacity-store-sm": ("pointopacity", pointopacity),
+        "image-opacity-store-sm": ("image_opacity", image_opacity),
+    }
+    name, setting = settings[ctx.triggered_id]
+    shown = figure_id(
+        tab, value, layer, image_layer, category_selected, block, full_resolution
+    )
+    if not style or style["figure"] != shown:
+        return no_update
+    paths = style["paths"]
+    if setting is None or not paths[name]:
         return no_update
-    return dcc.send_file(f"{FD['volumetric-map']}/{row['Block']}/{row['Name']}")
+    if name == "color":
+        # resolve the name, as Plotly.js only knows some of the named color scales
+        setting = get_named_colorscale(setting)
+
+    patch = Patch()
+    for path in paths[name]:
+        target = patch["data"]
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = setting
+    return patch
@@ -1,11 +1,18 @@
-from dash import dcc, html
+import base64
+from functools import lru_cache
+from pathlib import Path
+from dash import dcc, get_relative_path, html
 import dash_bootstrap_components as dbc
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import dash_ag_grid as dag
+from plotly.io.json import to_json_plotly
 from pages.constants import FILE_DESTINATION as FD
 
+# Sphere view switches from meshes to markers above this many spheres
+SPHERE_MARKER_THRESHOLD = 5000
+
 C_SCHEMES = [
     "bluered",
     "deep",
@@ -65,6 +72,16 @@ def make_summary_grids(organs, df, columns, key, desc, which_grid):
     return html.Div(sections)
 
 
+# published file functions
+def file_signature(files: list) -> tuple:
+    """Returns the path, modification time, and size of each file. Raises FileNotFoundError if a file is missing."""
+    signature = []
+    for file in files:
+        stat = Path(file).stat()
+        signature.append((str(file), stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
 # generic layout functions
 def make_tabs(id: str, active: str, tabs: list) -> object:
     """
@@ -114,6 +131,17 @@ def make_volumetric_map_filters(defaults: dict, layers: dict, values: list):
                             ),
                         ]
                     ),
+                    dbc.Col(
+                        [
+                            html.P("Level of detail:", className="card-text"),
+                            dbc.Switch(
+                                label="Full resolution",
+                                value=False,
+                                id="fullresswitch",
+                            ),
+                        ],
+                        width="auto",
+                    ),
                 ],
                 justify="center",
             ),
@@ -130,12 +158,14 @@ def make_downloads_ui_elements(downloads: pd.DataFrame) -> list:
         download_items.append(
             html.Div(
                 dbc.Button(
-                    downloads.loc[i, "Label"], id={"type": "btn-download", "index": i}
+                    downloads.loc[i, "Label"],
+                    id={"type": "btn-download", "index": i},
+                    href=get_relative_path(f"/download/volumetric-map/{i}"),
+                    external_link=True,
                 ),
                 className="download-button-container",
             ),
         )
-        download_items.append(dcc.Download(id={"type": "dcc-download", "index": i}))
         download_items.append(html.Hr())
     return download_items
 
@@ -318,26 +348,6 @@ def make_extra_filters(
 
 
 # Graph functions
-def select_layer(zlayer: str, df: pd.DataFrame, z_axis: list):
-    if zlayer == "All":
-        return df
-    else:
-        # get layer num
-        layer = int(zlayer[-1])
-        lower = z_axis[layer - 1]
-        upper = z_axis[layer]
-        return df[(df["Z Center"] >= lower) & (df["Z Center"] < upper)]
-
-
-def select_category(category_opt, category_labels, df):
-    if category_opt == "All":
-        return df
-    elif category_opt == category_labels["Label (Only True)"]:
-        return df[df["Category"]]
-    elif category_opt == category_labels["Label (Only False)"]:
-        return df[~df["Category"]]
-
-
 def set_layout(fig, axes):
     fig.update_layout(
         scene=dict(
@@ -360,31 +370,254 @@ def set_layout(fig, axes):
     )
 
 
-def get_colors(df, value, y_axis):
-    colors = []
-    for i in range(len(y_axis) - 1):
-        colors.append(
-            df[(df["Y Center"] >= y_axis[i]) & (df["Y Center"] < y_axis[i + 1])]
-            .loc[:, value]
-            .to_list(),
+def axis_centers(axis: list) -> np.ndarray:
+    """Returns the center of each bin between consecutive axis ticks"""
+    edges = np.asarray(axis, dtype=float)
+    return (edges[:-1] + edges[1:]) / 2
+
+
+def axis_bins(centers, axis: list) -> np.ndarray:
+    """Returns the index of the axis bin holding each center, or -1 if it is outside the axis"""
+    edges = np.asarray(axis, dtype=float)
+    bins = np.searchsorted(edges, np.asarray(centers, dtype=float), side="right") - 1
+    bins[(bins < 0) | (bins >= len(edges) - 1)] = -1
+    return bins
+
+
+# Columns of the points data that describe a point rather than holding a value
+POINT_COLUMNS = [
+    "Block ID",
+    "X Center",
+    "Y Center",
+    "Z Center",
+    "X Size",
+    "Y Size",
+    "Z Size",
+    "Category",
+]
+
+
+def layer_number(layer: str) -> int:
+    """Returns the zero-based index of a layer option such as "Layer 2" """
+    return int(layer.split()[-1]) - 1
+
+
+class VoxelGrid:
+    """
+    Dense representation of the points data for one block. Each value column is held as a (Z, Y, X) array with one
+    cell per bin of the axes, alongside masks of the cells that hold a point and of the cells in the category.
+    Layer and category selections are made by slicing these arrays instead of filtering the rows of the points data.
+    """
+
+    def __init__(
+        self,
+        axes: dict,
+        occupied: np.ndarray,
+        category: np.ndarray,
+        values: dict,
+    ):
+        self.axes = axes
+        self.centers = {label: axis_centers(axes[label]) for label in ["X", "Y", "Z"]}
+        self.widths = {
+            label: np.diff(np.asarray(axes[label], dtype=float))
+            for label in ["X", "Y", "Z"]
+        }
+        self.shape = occupied.shape
+        self.occupied = occupied
+        self.category = category
+        self.values = values
+        for array in [self.occupied, self.category, *self.values.values()]:
+            array.flags.writeable = False
+
+    @classmethod
+    def from_points(cls, df: pd.DataFrame, axes: dict):
+        shape = tuple(len(axes[label]) - 1 for label in ["Z", "Y", "X"])
+        z = axis_bins(df["Z Center"], axes["Z"])
+        y = axis_bins(df["Y Center"], axes["Y"])
+        x = axis_bins(df["X Center"], axes["X"])
+        inside = (z >= 0) & (y >= 0) & (x >= 0)
+        cells = (z[inside], y[inside], x[inside])
+
+        occupied = np.zeros(shape, dtype=bool)
+        occupied[cells] = True
+        category = np.zeros(shape, dtype=bool)
+        category[cells] = df["Category"].to_numpy(dtype=bool, na_value=False)[inside]
+        values = {}
+        for column in df.columns:
+            if column in POINT_COLUMNS:
+                continue
+            grid = np.full(shape, np.nan)
+            grid[cells] = df[column].to_numpy(dtype=float)[inside]
+            values[column] = grid
+        return cls(axes, occupied, category, values)
+
+    def downsample(self, factor: int):
+        """
+        Returns a coarser grid in which each cell covers up to factor cells of this grid along each axis. Values
+        are averaged over the cells holding a point, and a coarse cell is in the category if most of its points are.
+        """
+        axes = {}
+        for label in ["X", "Y", "Z"]:
+            ticks = list(self.axes[label][::factor])
+            if ticks[-1] != self.axes[label][-1]:
+                ticks.append(self.axes[label][-1])
+            axes[label] = ticks
+
+        counts = pool_sum(self.occupied, factor)
+        category_counts = pool_sum(self.category & self.occupied, factor)
+        values = {}
+        for column, grid in self.values.items():
+            present = ~np.isnan(grid)
+            totals = pool_sum(np.where(present, grid, 0), factor)
+            numbers = pool_sum(present, factor)
+            values[column] = np.divide(
+                totals,
+                numbers,
+                out=np.full(totals.shape, np.nan),
+                where=numbers > 0,
+            )
+        return VoxelGrid(
+            axes, counts > 0, (category_counts * 2 >= counts) & (counts > 0), values
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            array.nbytes
+            for array in [self.occupied, self.category, *self.values.values()]
+        )
+
+    def layer_slice(self, layer: str = "All") -> slice:
+        if layer == "All":
+            return slice(None)
+        k = layer_number(layer)
+        return slice(k, k + 1)
+
+    def select(
+        self, layer: str = "All", category_opt: str = "All", category_labels=None
+    ) -> np.ndarray:
+        """Returns a (Z, Y, X) mask of the cells holding a point in the layer and category"""
+        mask = np.zeros(self.shape, dtype=bool)
+        zs = self.layer_slice(layer)
+        mask[zs] = self.occupied[zs]
+        if category_opt == "All" or not category_labels:
+            return mask
+        elif category_opt == category_labels["Label (Only True)"]:
+            return mask & self.category
+        elif category_opt == category_labels["Label (Only False)"]:
+            return mask & ~self.category
+        return mask
+
+    def cells(self, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Returns the z, y, x indices of the cells in mask, ordered by X, then Y, then Z like the points data"""
+        x, y, z = np.nonzero(mask.transpose(2, 1, 0))
+        return z, y, x
+
+    def points(self, mask: np.ndarray, value: str) -> tuple[np.ndarray, np.ndarray]:
+        """Returns the center of each cell in mask as an array of shape (n, 3), and the cell values"""
+        z, y, x = self.cells(mask)
+        centers = np.stack(
+            [self.centers["X"][x], self.centers["Y"][y], self.centers["Z"][z]], axis=1
+        )
+        return centers, self.values[value][z, y, x]
+
+    def cell_sizes(self, mask: np.ndarray) -> np.ndarray:
+        """Returns the size of each cell in mask along the X, Y, and Z axes as an array of shape (n, 3)"""
+        z, y, x = self.cells(mask)
+        return np.stack(
+            [self.widths["X"][x], self.widths["Y"][y], self.widths["Z"][z]], axis=1
         )
-    return colors
-
-
-def gen_cube_triangles(df: pd.DataFrame) -> np.ndarray:
-    # In the dataset, within each set of points representing a cube, the points are ordered as follows:
-    # [
-    #     [x, y, z],
-    #     [x + x_dist, y, z],
-    #     [x, y + y_dist, z],
-    #     [x + x_dist, y + y_dist, z],
-    #     [x, y, z + z_dist],
-    #     [x + x_dist, y, z + z_dist],
-    #     [x, y + y_dist, z + z_dist],
-    #     [x + x_dist, y + y_dist, z + z_dist],
-    # ]
-
-    triangle_pattern = [
+
+
+def pool_sum(array: np.ndarray, factor: int) -> np.ndarray:
+    """Sums each block of factor cells along every axis of a 3D array. Blocks at the far edges may be smaller."""
+    padding = [(0, -size % factor) for size in array.shape]
+    padded = np.pad(array.astype(float), padding)
+    blocks = []
+    for size in padded.shape:
+        blocks.extend([size // factor, factor])
+    return padded.reshape(blocks).sum(axis=(1, 3, 5))
+
+
+def coarse_cell_count(cells: np.ndarray, shape: tuple, factor: int) -> int:
+    """Counts the cells of a grid downsampled by factor that hold any of the given (z, y, x) cells of the grid"""
+    coarse_shape = [-(-size // factor) for size in shape]
+    return np.unique(np.ravel_multi_index((cells // factor).T, coarse_shape)).size
+
+
+def lod_factor(
+    grid: VoxelGrid, vertices_per_cell: int, max_vertices: int, dense=False
+) -> int:
+    """
+    Returns the smallest downsampling factor that keeps a figure of the grid within max_vertices. Dense figures
+    draw every cell of the grid, others only draw the cells holding a point. The figure's cells are counted from
+    the grid's shape or its occupied cells, without downsampling the grid.
+    """
+    budget = max_vertices // vertices_per_cell
+    if dense:
+        total = int(np.prod(grid.shape))
+    else:
+        cells = np.argwhere(grid.occupied)
+        total = len(cells)
+    if total <= budget:
+        return 1
+    # a coarse cell covers at most factor**3 cells, so smaller factors cannot fit the budget
+    largest = max(grid.shape)
+    factor = 2
+    while factor < largest and budget * factor**3 < total:
+        factor += 1
+    while factor < largest:
+        if dense:
+            count = np.prod([-(-size // factor) for size in grid.shape])
+        else:
+            count = coarse_cell_count(cells, grid.shape, factor)
+        if count <= budget:
+            break
+        factor += 1
+    return factor
+
+
+# Offsets from the center of a cube to each of its vertices, as multiples of the cube size in the order used by
+# gen_cube_triangles. 0 means the lower side of the cube, 1 the upper side.
+CUBE_VERTEX_ORDER = np.array(
+    [
+        [0, 0, 0],
+        [1, 0, 0],
+        [0, 1, 0],
+        [1, 1, 0],
+        [0, 0, 1],
+        [1, 0, 1],
+        [0, 1, 1],
+        [1, 1, 1],
+    ],
+    dtype=bool,
+)
+
+
+def make_cube_vertices(centers: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """For each point representing the center of a rectangular prism, calculates eight points representing
+    its vertices. sizes is either one size for every prism or one per prism. Returns an array of shape (8 * n, 3)
+    in the vertex order used by gen_cube_triangles."""
+    half = np.asarray(sizes, dtype=float)[..., np.newaxis, :] / 2
+    # the upper side is pulled in slightly so that neighboring cubes do not share faces
+    offsets = np.where(CUBE_VERTEX_ORDER, half - 0.001, -half)
+    vertices = centers[:, np.newaxis, :] + offsets
+    return vertices.reshape(-1, 3)
+
+
+# In the dataset, within each set of points representing a cube, the points are ordered as follows:
+# [
+#     [x, y, z],
+#     [x + x_dist, y, z],
+#     [x, y + y_dist, z],
+#     [x + x_dist, y + y_dist, z],
+#     [x, y, z + z_dist],
+#     [x + x_dist, y, z + z_dist],
+#     [x, y + y_dist, z + z_dist],
+#     [x + x_dist, y + y_dist, z + z_dist],
+# ]
+CUBE_TRIANGLES = np.array(
+    [
         [0, 1, 2],
         [0, 1, 4],
         [0, 2, 4],
@@ -398,38 +631,48 @@ def gen_cube_triangles(df: pd.DataFrame) -> np.ndarray:
         [7, 6, 3],
         [7, 3, 5],
     ]
+)
+
 
-    all_triangles = []
+@lru_cache(maxsize=32)
+def cube_triangles(num_cubes: int) -> np.ndarray:
+    """Returns the i, j, k vertex indices of the triangles that make up num_cubes cubes as an array of shape
+    (3, 12 * num_cubes). Results are cached by cube count, so the returned array is read-only."""
+    offsets = np.arange(num_cubes) * 8
+    faces = offsets[:, np.newaxis, np.newaxis] + CUBE_TRIANGLES[np.newaxis, :, :]
+    faces = np.ascontiguousarray(faces.reshape(-1, 3).T)
+    faces.flags.writeable = False
+    return faces
 
-    for m in range(0, df.shape[0], 8):
-        all_triangles.extend([[m + x[0], m + x[1], m + x[2]] for x in triangle_pattern])
 
-    faces1 = np.array(all_triangles)
-    return np.transpose(faces1)
+def gen_cube_triangles(df) -> np.ndarray:
+    # each set of eight rows in df is one cube
+    return cube_triangles((df.shape[0] + 7) // 8)
 
 
 def make_point_fig(
     axes,
     value_ranges,
-    df,
+    grid,
     opacity=0.1,
     colorscheme="haline",
     value="",
     layer="All",
 ):
     """Create figure for point view of volumetric map data"""
-    df4 = select_layer(layer, df, axes["Z"])
-    X = df4.loc[:, "X Center"]
-    Y = df4.loc[:, "Y Center"]
-    Z = df4.loc[:, "Z Center"]
-    values = df4.loc[:, value]
+    zs = grid.layer_slice(layer)
+    # the volume is given as a flattened (X, Y, Z) grid
+    X, Y, Z = np.meshgrid(
+        grid.centers["X"], grid.centers["Y"], grid.centers["Z"][zs], indexing="ij"
+    )
+    values = grid.values[value][zs].transpose(2, 1, 0)
 
     fig2 = go.Figure(
         data=go.Volume(
-            x=X,
-            y=Y,
-            z=Z,
-            value=values,
+            x=X.ravel(),
+            y=Y.ravel(),
+            z=Z.ravel(),
+            value=values.ravel(),
             isomin=value_ranges[0],
             isomax=value_ranges[1],
             opacity=opacity,
@@ -446,66 +689,28 @@ def make_point_fig(
 def make_layer_fig(
     axes,
     value_ranges,
-    df,
+    grid,
     colorscheme="haline",
     value="",
     layer="All",
 ):
     """Create figure for layer view of volumetric map data"""
     data = []
+    X = grid.centers["X"]
+    Y = grid.centers["Y"]
 
-    if layer == "All":
-        for k in range(len(axes["Z"]) - 1):
-            this_layer = select_layer(f"Layer {k + 1}", df, axes["Z"])
-            color_set = get_colors(this_layer, value, axes["Y"])
-            X = this_layer.loc[:, "X Center"].unique()
-            Y = this_layer.loc[:, "Y Center"].unique()
-            z_val = this_layer.loc[:, "Z Center"].unique()[0]
-            Z = [[z_val for i in X] for j in Y]
-            if k == 0:
-                data.append(
-                    go.Surface(
-                        x=X,
-                        y=Y,
-                        z=Z,
-                        colorscale=colorscheme,
-                        surfacecolor=color_set,
-                        name=f"Layer {k + 1}",
-                        cmin=value_ranges[0],
-                        cmax=value_ranges[1],
-                    ),
-                )
-            else:
-                data.append(
-                    go.Surface(
-                        x=X,
-                        y=Y,
-                        z=Z,
-                        colorscale=colorscheme,
-                        surfacecolor=color_set,
-                        name=f"Layer {k + 1}",
-                        cmin=value_ranges[0],
-                        cmax=value_ranges[1],
-                        showscale=False,
-                    ),
-                )
-    else:
-        this_layer = select_layer(layer, df, axes["Z"])
-        color_set = get_colors(this_layer, value, axes["Y"])
-        X = this_layer.loc[:, "X Center"].unique()
-        Y = this_layer.loc[:, "Y Center"].unique()
-        z_val = this_layer.loc[:, "Z Center"].unique()[0]
-        Z = [[z_val for i in X] for j in Y]
+    for k in range(grid.shape[0])[grid.layer_slice(layer)]:
         data.append(
             go.Surface(
                 x=X,
                 y=Y,
-                z=Z,
+                z=np.full((len(Y), len(X)), grid.centers["Z"][k]),
                 colorscale=colorscheme,
-                surfacecolor=color_set,
-                name=layer,
+                surfacecolor=grid.values[value][k],
+                name=f"Layer {k + 1}",
                 cmin=value_ranges[0],
                 cmax=value_ranges[1],
+                showscale=len(data) == 0,
             ),
         )
 
@@ -561,68 +766,119 @@ def make_sphere(x, y, z, radius, resolution=5):
     return (X, Y, Z)
 
 
+@lru_cache(maxsize=8)
+def make_sphere_template(radius, resolution=5) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Triangulates the sphere calculated by make_sphere for a center at the origin. Returns the vertices as an array
+    of shape (n, 3) and the triangles as an array of shape (m, 3). Results are cached and read-only.
+    """
+    (X, Y, Z) = make_sphere(0, 0, 0, radius, resolution)
+    grid_vertices = np.stack([X.ravel(), Y.ravel(), Z.ravel()], axis=1)
+
+    # split each cell of the u, v grid into two triangles
+    rows, cols = X.shape
+    r, c = np.meshgrid(np.arange(rows - 1), np.arange(cols - 1), indexing="ij")
+    corner = (r * cols + c).ravel()
+    triangles = np.concatenate(
+        [
+            np.stack([corner, corner + 1, corner + cols + 1], axis=1),
+            np.stack([corner, corner + cols + 1, corner + cols], axis=1),
+        ]
+    )
+
+    # the grid repeats vertices at the poles and along the seam, so merge them and drop the collapsed triangles
+    vertices, inverse = np.unique(
+        grid_vertices.round(decimals=9), axis=0, return_inverse=True
+    )
+    triangles = inverse.reshape(-1)[triangles]
+    distinct = (
+        (triangles[:, 0] != triangles[:, 1])
+        & (triangles[:, 1] != triangles[:, 2])
+        & (triangles[:, 0] != triangles[:, 2])
+    )
+    triangles = triangles[distinct]
+    vertices.flags.writeable = False
+    triangles.flags.writeable = False
+    return vertices, triangles
+
+
+def make_sphere_mesh(
+    centers: np.ndarray, values: np.ndarray, radius, resolution=5
+) -> dict:
+    """Calculates a single mesh containing a sphere around each center, colored by the matching value"""
+    vertices, triangles = make_sphere_template(radius, resolution)
+    all_vertices = centers[:, np.newaxis, :] + vertices[np.newaxis, :, :]
+    offsets = np.arange(centers.shape[0]) * vertices.shape[0]
+    all_triangles = offsets[:, np.newaxis, np.newaxis] + triangles[np.newaxis, :, :]
+    all_vertices = all_vertices.reshape(-1, 3)
+    all_triangles = all_triangles.reshape(-1, 3)
+    return {
+        "x": all_vertices[:, 0],
+        "y": all_vertices[:, 1],
+        "z": all_vertices[:, 2],
+        "i": all_triangles[:, 0],
+        "j": all_triangles[:, 1],
+        "k": all_triangles[:, 2],
+        "intensity": np.repeat(values, vertices.shape[0]),
+    }
+
+
 def make_sphere_fig(
     axes,
     value_ranges,
     category_labels,
-    df,
+    grid,
     opacity=1,
     colorscheme="haline",
     value="",
     layer="All",
     category_opt="All",
+    mode="auto",
 ):
-    """Create figure for sphere view of volumetric map data"""
+    """
+    Create figure for sphere view of volumetric map data.
+
+    In "mesh" mode all of the spheres are drawn as one mesh. In "markers" mode each sphere is drawn as a marker,
+    which is much cheaper for very large blocks. "auto" chooses markers once there are more than
+    SPHERE_MARKER_THRESHOLD spheres.
+    """
     res = 5
-    data = []
 
-    layer_df = select_layer(layer, df, axes["Z"])
-    layer_df = select_category(category_opt, category_labels, layer_df)
-
-    scalebar = False
-    for k in layer_df.index:
-        s_color = layer_df.loc[k, value]
-        if not np.isnan(s_color):
-            (X, Y, Z) = make_sphere(
-                x=layer_df.loc[k, "X Center"],
-                y=layer_df.loc[k, "Y Center"],
-                z=layer_df.loc[k, "Z Center"],
-                radius=14,
-                resolution=res,
-            )
-            c = [[s_color.item() for i in range(res)] for j in range(res * 2)]
-            if not scalebar:
-                data.append(
-                    go.Surface(
-                        x=X,
-                        y=Y,
-                        z=Z,
-                        surfacecolor=c,
-                        colorscale=colorscheme,
-                        cmin=value_ranges[0],
-                        cmax=value_ranges[1],
-                        opacity=opacity,
-                        name=f"val:\n{s_color.item()}",
-                    )
-                )
-                scalebar = True
-            else:
-                data.append(
-                    go.Surface(
-                        x=X,
-                        y=Y,
-                        z=Z,
-                        surfacecolor=c,
-                        colorscale=colorscheme,
-                        cmin=value_ranges[0],
-                        cmax=value_ranges[1],
-                        showscale=False,
-                        opacity=opacity,
-                        name=f"val:\n{s_color.item()}",
-                    )
-                )
+    mask = grid.select(layer, category_opt, category_labels)
+    mask &= ~np.isnan(grid.values[value])
+    centers, values = grid.points(mask, value)
+
+    if mode == "auto":
+        mode = "markers" if centers.shape[0] > SPHERE_MARKER_THRESHOLD else "mesh"
+
+    if mode == "markers":
+        trace = go.Scatter3d(
+            x=centers[:, 0],
+            y=centers[:, 1],
+            z=centers[:, 2],
+            mode="markers",
+            marker=dict(
+                size=6,
+                color=values,
+                colorscale=colorscheme,
+                cmin=value_ranges[0],
+                cmax=value_ranges[1],
+                opacity=opacity,
+                showscale=True,
+            ),
+            hovertemplate="val: %{marker.color:.6~g}<extra></extra>",
+        )
+    else:
+        trace = go.Mesh3d(
+            **make_sphere_mesh(centers, values, radius=14, resolution=res),
+            colorscale=colorscheme,
+            cmin=value_ranges[0],
+            cmax=value_ranges[1],
+            opacity=opacity,
+            hovertemplate="val: %{intensity:.6~g}<extra></extra>",
+        )
 
-    fig4 = go.Figure(data=data)
+    fig4 = go.Figure(data=[trace])
     set_layout(fig4, axes)
     return fig4
 
@@ -631,7 +887,7 @@ def make_cube_fig(
     axes,
     value_ranges,
     category_labels,
-    df,
+    grid,
     opacity=0.4,
     colorscheme="haline",
     value="",
@@ -639,15 +895,15 @@ def make_cube_fig(
     category_opt="All",
 ):
     """Create figure for cube view of volumetric map data"""
-    df2 = select_layer(layer, df, axes["Z"])
-    df3 = select_category(category_opt, category_labels, df2)
+    mask = grid.select(layer, category_opt, category_labels)
+    centers, values = grid.points(mask, value)
+    vertices = make_cube_vertices(centers, grid.cell_sizes(mask))
+    X = vertices[:, 0]
+    Y = vertices[:, 1]
+    Z = vertices[:, 2]
+    values = np.repeat(values, 8)
 
-    X = df3.loc[:, "X Center"]
-    Y = df3.loc[:, "Y Center"]
-    Z = df3.loc[:, "Z Center"]
-    values = df3.loc[:, value]
-
-    faces = gen_cube_triangles(df3)
+    faces = gen_cube_triangles(vertices)
 
     fig1 = go.Figure(
         data=go.Mesh3d(
@@ -695,7 +951,7 @@ def make_cube_image_fig(
     axes,
     value_ranges,
     category_labels,
-    df,
+    grid,
     opacity=0.4,
     colorscheme="haline",
     value="",
@@ -707,15 +963,15 @@ def make_cube_image_fig(
     colorscale=None,
 ):
     """Create figure for cube view of volumetric map data"""
-    df2 = select_layer(layer, df, axes["Z"])
-    df3 = select_category(category_opt, category_labels, df2)
-
-    X = df3.loc[:, "X Center"]
-    Y = df3.loc[:, "Y Center"]
-    Z = df3.loc[:, "Z Center"]
-    values = df3.loc[:, value]
+    mask = grid.select(layer, category_opt, category_labels)
+    centers, values = grid.points(mask, value)
+    vertices = make_cube_vertices(centers, grid.cell_sizes(mask))
+    X = vertices[:, 0]
+    Y = vertices[:, 1]
+    Z = vertices[:, 2]
+    values = np.repeat(values, 8)
 
-    faces = gen_cube_triangles(df3)
+    faces = gen_cube_triangles(vertices)
 
     colors = get_colorscale(colorscale)
 
@@ -751,3 +1007,73 @@ def make_cube_image_fig(
     fig1 = go.Figure(data=data)
     set_layout(fig1, axes)
     return fig1
+
+
+# Figure encoding
+# Trace properties sent to the browser as typed arrays rather than JSON numbers
+TYPED_ARRAY_KEYS = ["x", "y", "z", "i", "j", "k", "intensity", "value", "surfacecolor"]
+TYPED_ARRAY_DTYPES = {
+    np.dtype(np.int8): "i1",
+    np.dtype(np.uint8): "u1",
+    np.dtype(np.int16): "i2",
+    np.dtype(np.uint16): "u2",
+    np.dtype(np.int32): "i4",
+    np.dtype(np.uint32): "u4",
+    np.dtype(np.float32): "f4",
+    np.dtype(np.float64): "f8",
+}
+
+
+def smallest_int_type(low, high) -> np.dtype | None:
+    """Returns the smallest integer type holding every number from low to high"""
+    for dtype in [np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32]:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return None
+
+
+def compact_array(key: str, values) -> np.ndarray | None:
+    """
+    Returns values in the smallest type that represents them for display, or None if they are not numeric.
+    Whole numbers, such as image pixels and coordinates on the axis grid, use the smallest integer type of up to
+    two bytes that holds them, and face indices up to uint32. Other numbers are float32.
+    """
+    array = np.asarray(values)
+    if array.dtype.kind not in "uif" or array.size == 0:
+        return None
+    if np.isfinite(array).all() and np.all(array == np.round(array)):
+        dtype = smallest_int_type(array.min(), array.max())
+        if dtype is not None and (dtype.itemsize <= 2 or key in ["i", "j", "k"]):
+            return array.astype(dtype)
+    return array.astype(np.float32)
+
+
+def typed_array(array: np.ndarray) -> dict:
+    """Returns the Plotly.js typed array form of a little-endian array"""
+    array = np.ascontiguousarray(array)
+    spec = {
+        "dtype": TYPED_ARRAY_DTYPES[array.dtype],
+        "bdata": base64.b64encode(array.astype(array.dtype.newbyteorder("<"))).decode(
+            "ascii"
+        ),
+    }
+    if array.ndim > 1:
+        spec["shape"] = ", ".join(str(size) for size in array.shape)
+    return spec
+
+
+def encode_figure(fig: go.Figure) -> str:
+    """Serializes a figure with its coordinates, values, and faces as base64 typed arrays"""
+    figure = fig.to_plotly_json()
+    for trace in figure["data"]:
+        properties = [(trace, key) for key in TYPED_ARRAY_KEYS]
+        if isinstance(trace.get("marker"), dict):
+            properties.append((trace["marker"], "color"))
+        for parent, key in properties:
+            if parent.get(key) is None or isinstance(parent[key], str):
+                continue
+            array = compact_array(key, parent[key])
+            if array is not None:
+                parent[key] = typed_array(array)
+    return to_json_plotly(figure)
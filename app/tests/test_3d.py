@@ -5,7 +5,11 @@ import pytest
 from dash import dcc, html
 import numpy as np
 import os
+import shutil
+from pathlib import Path
 import sys
+import threading
+import time
 from dash._callback_context import context_value
 from dash._utils import AttributeDict
 
@@ -14,10 +18,14 @@ if os.getcwd() not in sys.path:
 import app
 from pages.model3d import (
     display_click_data,
+    filter_blocks,
+    get_model_index,
     make_mesh_data,
     make_mesh_fig,
     make_mesh_settings,
+    models_version,
     read_obj,
+    render_mesh_fig,
 )
 from pages.constants import FILE_DESTINATION as FD
 
@@ -36,6 +44,49 @@ def test_read_obj():
         vertices, faces = read_obj(f"{FD["obj-files"]["summary"]}/obj-files.csv")
 
 
+def test_read_obj_mesh_file(tmp_path):
+    obj_file = tmp_path / "sphere.obj"
+    shutil.copy(f"{FD["obj-files"]["volumes"]}/sphere.obj", obj_file)
+    expected_vertices, expected_faces = read_obj(str(obj_file))
+
+    np.savez(
+        tmp_path / "sphere.npz",
+        vertices=expected_vertices.astype(np.float32),
+        faces=expected_faces.astype(np.uint32),
+    )
+    vertices, faces = read_obj(str(obj_file))
+    assert vertices.dtype == np.float32
+    assert faces.dtype == np.uint32
+    assert np.allclose(vertices, expected_vertices)
+    assert np.array_equal(faces, expected_faces) is True
+
+    # a mesh file older than its obj file is ignored
+    os.utime(tmp_path / "sphere.npz", ns=(0, 0))
+    vertices, faces = read_obj(str(obj_file))
+    assert vertices.dtype == np.float64
+
+
+def test_read_obj_detail_level(tmp_path):
+    obj_file = tmp_path / "sphere.obj"
+    shutil.copy(f"{FD["obj-files"]["volumes"]}/sphere.obj", obj_file)
+    full_vertices, full_faces = read_obj(str(obj_file))
+    np.savez(
+        tmp_path / "sphere.npz",
+        vertices=full_vertices.astype(np.float32),
+        faces=full_faces.astype(np.uint32),
+        vertices_1=full_vertices[:3].astype(np.float32),
+        faces_1=np.array([[0, 1, 2]], dtype=np.uint32),
+    )
+
+    vertices, faces = read_obj(str(obj_file), 1)
+    assert faces.shape == (1, 3)
+    # the most detailed level available up to the requested one is used
+    vertices, faces = read_obj(str(obj_file), 3)
+    assert faces.shape == (1, 3)
+    vertices, faces = read_obj(str(obj_file), 0)
+    assert faces.shape == (960, 3)
+
+
 def test_make_mesh_settings():
     vertices, faces = read_obj(f"{FD["obj-files"]["volumes"]}/S1_Sphere_Lower_S1-1.obj")
     settings1 = make_mesh_settings(
@@ -89,6 +140,96 @@ def test_make_mesh_fig():
     fig1 = make_mesh_fig(0)
     assert len(fig1["data"]) == 9
     assert fig1["layout"]["height"] == 500
+    fig2 = make_mesh_fig(0, 0)
+    assert len(fig2["data"]) == 9
+
+
+def test_mesh_fig_trace_order(monkeypatch):
+    module = sys.modules[render_mesh_fig.__module__]
+    make_mesh_data = module.make_mesh_data
+    names = get_model_index()["organ_traces"][0]
+
+    in_worker = {}
+
+    # the first traces finish loading last
+    def slow_mesh_data(name, file, *args):
+        worker = threading.current_thread() is not threading.main_thread()
+        in_worker[name] = (worker, "Middle" not in file)
+        time.sleep(0.02 * (len(names) - names.index(name)))
+        if name == "S1-4":
+            raise FileNotFoundError
+        return make_mesh_data(name, file, *args)
+
+    # only models with a mesh file are read in the thread pool
+    mesh_files = []
+    for obj_file in Path(FD["obj-files"]["volumes"]).glob("*.obj"):
+        if "Middle" not in obj_file.name:
+            vertices, faces = read_obj(str(obj_file))
+            mesh_files.append(obj_file.with_suffix(".npz"))
+            np.savez(mesh_files[-1], vertices=vertices, faces=faces)
+    monkeypatch.setattr(module, "make_mesh_data", slow_mesh_data)
+    try:
+        fig = render_mesh_fig.uncached(0, 0, "")
+    finally:
+        for mesh_file in mesh_files:
+            mesh_file.unlink()
+    assert [trace["name"] for trace in fig["data"]] == [
+        name for name in names if name != "S1-4"
+    ]
+    for worker, has_mesh in in_worker.values():
+        assert worker is has_mesh
+    assert {worker for worker, has_mesh in in_worker.values()} == {True, False}
+
+
+def test_models_version(monkeypatch):
+    version = models_version()
+
+    # the version comes from the model index, so cached figures are found without reading the models
+    def read_csv(*args, **kwargs):
+        raise AssertionError("csv read")
+
+    monkeypatch.setattr(sys.modules[models_version.__module__].pd, "read_csv", read_csv)
+    assert models_version() == version
+    monkeypatch.undo()
+
+    # republishing the models changes the version and so the cache key of the figures
+    summary = f"{FD["obj-files"]["summary"]}/obj-files.csv"
+    stat = os.stat(summary)
+    os.utime(summary, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    try:
+        assert models_version() != version
+    finally:
+        os.utime(summary, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert models_version() == version
+
+
+def test_get_model_index(monkeypatch):
+    index = get_model_index()
+    assert index["organ_traces"][0][:2] == ["Body", "S1-1"]
+
+    # clicks are answered from the index without reading the csv files again
+    def read_csv(*args, **kwargs):
+        raise AssertionError("csv read")
+
+    monkeypatch.setattr(
+        sys.modules[get_model_index.__module__].pd, "read_csv", read_csv
+    )
+    block_name, row = filter_blocks("S1-7")
+    assert block_name == "S1-7"
+    assert row.iloc[0]["Anatomical region"] == "Middle"
+    block_name, row = filter_blocks("Body")
+    assert block_name == ""
+    assert row.empty
+    assert get_model_index() is index
+    monkeypatch.undo()
+
+    # the index is rebuilt when the block data changes
+    stat = os.stat(FD["si-block"]["block-data"])
+    os.utime(FD["si-block"]["block-data"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    try:
+        assert get_model_index() is not index
+    finally:
+        os.utime(FD["si-block"]["block-data"], ns=(stat.st_atime_ns, stat.st_mtime_ns))
 
 
 def test_display_click_data():
@@ -0,0 +1,153 @@
+import gzip
+import json
+import logging
+import os
+import sys
+
+if os.getcwd() not in sys.path:
+    sys.path.append(os.getcwd())
+import app
+from pages.home import cache
+from pages.spatialmap import figure_cache, load_data, render_fig
+
+page_info, defaults, layers, cat_opts, value_info, axes, downloads = load_data("S1-12")
+
+
+def figure_request() -> dict:
+    """Builds the request the volumetric map page sends for its figure"""
+    inputs = {
+        "volumetric-tabs.active_tab": "cube-tab",
+        "value-store.data": defaults["d_value"],
+        "layer-store-sm.data": "All",
+        "image-layer-selected-sm.data": "All",
+        "category-selected.data": "All",
+        "fullresswitch.value": False,
+    }
+    states = {
+        "color-store-sm.data": "haline",
+        "cube-opacity-store-sm.data": 0.4,
+        "point-opacity-store-sm.data": 0.1,
+        "image-opacity-store-sm.data": 1,
+        "category-store.data": cat_opts,
+        "value-range-store.data": value_info,
+        "axes-store.data": axes,
+        "block-store.data": "S1-12",
+    }
+
+    def props(values: dict) -> list:
+        items = []
+        for key, value in values.items():
+            id, prop = key.split(".")
+            items.append({"id": id, "property": prop, "value": value})
+        return items
+
+    return {
+        "output": "..volumetric-map-graph.figure...figure-style-sm.data..",
+        "outputs": [
+            {"id": "volumetric-map-graph", "property": "figure"},
+            {"id": "figure-style-sm", "property": "data"},
+        ],
+        "inputs": props(inputs),
+        "state": props(states),
+        "changedPropIds": ["volumetric-tabs.active_tab"],
+    }
+
+
+def test_compress_callback_response():
+    client = app.server.test_client()
+    plain = client.post(
+        "/_dash-update-component",
+        json=figure_request(),
+        headers={"Accept-Encoding": "identity"},
+    )
+    compressed = client.post(
+        "/_dash-update-component",
+        json=figure_request(),
+        headers={"Accept-Encoding": "gzip, deflate"},
+    )
+    assert plain.status_code == 200
+    assert "Content-Encoding" not in plain.headers
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert len(compressed.data) < len(plain.data) / 2
+
+    body = json.loads(gzip.decompress(compressed.data))
+    assert body == json.loads(plain.data)
+    figure, paths = render_fig(
+        "cube-tab",
+        "haline",
+        defaults["d_value"],
+        0.4,
+        0.1,
+        "All",
+        "All",
+        1,
+        "All",
+        cat_opts,
+        value_info,
+        axes,
+        "S1-12",
+        False,
+    )
+    assert body["response"]["volumetric-map-graph"]["figure"] == figure
+
+
+def test_compress_thresholds():
+    client = app.server.test_client()
+    app.server.config["COMPRESS_MIN_SIZE"] = 10**9
+    try:
+        response = client.get("/_dash-layout", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+    finally:
+        app.server.config["COMPRESS_MIN_SIZE"] = 500
+
+    response = client.get("/_dash-dependencies", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(response.data))
+    # only gzip is used
+    response = client.get("/_dash-dependencies", headers={"Accept-Encoding": "br"})
+    assert "Content-Encoding" not in response.headers
+    response = client.get(
+        "/_dash-dependencies", headers={"Accept-Encoding": "br;q=1, gzip;q=0.5"}
+    )
+    assert response.headers["Content-Encoding"] == "gzip"
+
+
+def test_warm_cache():
+    runner = app.server.test_cli_runner()
+    result = runner.invoke(args=["warm-cache"])
+    assert result.exit_code == 0
+    assert "Cached 3D model figures for 1 organs" in result.output
+
+
+def test_clear_caches():
+    with app.server.app_context():
+        cache.set("test-entry", 1)
+        figure_cache.set("test-figure", 1)
+        # clearing one cache leaves the other alone
+        assert cache.clear() is True
+        assert figure_cache.get("test-figure") == 1
+        assert figure_cache.clear() is True
+
+
+def test_prune_cache(caplog):
+    threshold = app.server.config["CACHE_THRESHOLD"]
+    with app.server.app_context():
+        cache.clear()
+        figure_cache.set("test-figure", 1)
+        with caplog.at_level(logging.WARNING):
+            for i in range(threshold + 10):
+                cache.set(f"test-entry-{i}", i)
+        assert caplog.records == []
+        # pruning runs before each new entry is written, and cachelib keeps a file with the entry count
+        assert len(os.listdir(app.server.config["CACHE_DIR"])) <= threshold + 2
+        assert figure_cache.get("test-figure") == 1
+        cache.clear()
+        figure_cache.clear()
+
+
+def test_tile_viewer_not_loaded_with_pages():
+    # OpenSeadragon is only fetched when the zoomable view is turned on
+    response = app.server.test_client().get("/")
+    assert response.status_code == 200
+    assert b"openseadragon" not in response.data.lower()
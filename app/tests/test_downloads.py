@@ -0,0 +1,70 @@
+import json
+import os
+import sys
+
+import plotly
+
+if os.getcwd() not in sys.path:
+    sys.path.append(os.getcwd())
+import app
+from pages.constants import FILE_DESTINATION as FD
+from pages.ocpage import layout
+
+
+def test_download_scientific_image():
+    client = app.server.test_client()
+    with open(f"{FD["sci-images"]}/S1-7/S1-7-2/S1-7-2.tif", "rb") as f:
+        original = f.read()
+
+    response = client.get("/download/scientific-images/S1-7-2")
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == "attachment; filename=S1-7-2.tif"
+    assert response.data == original
+
+    # resumed downloads only fetch the rest of the file
+    response = client.get(
+        "/download/scientific-images/S1-7-2", headers={"Range": "bytes=100-"}
+    )
+    assert response.status_code == 206
+    assert response.data == original[100:]
+
+    etag = client.get("/download/scientific-images/S1-7-2").headers["ETag"]
+    response = client.get(
+        "/download/scientific-images/S1-7-2", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    # image sets that do not exist or whose original has not been uploaded
+    assert client.get("/download/scientific-images/S1-99-1").status_code == 404
+    assert client.get("/download/scientific-images/S1-7-1").status_code == 404
+
+    # the download button links to the route
+    page = json.dumps(layout(iset="S1-7-2"), cls=plotly.utils.PlotlyJSONEncoder)
+    assert '"href": "/download/scientific-images/S1-7-2"' in page
+
+
+def test_download_volumetric_map_data(monkeypatch):
+    client = app.server.test_client()
+    response = client.get("/download/volumetric-map/0")
+    assert response.status_code == 200
+    assert "S1-12proteomics.xlsx" in response.headers["Content-Disposition"]
+    assert client.get("/download/volumetric-map/1").status_code == 404
+
+    # nginx sends the file when it is configured to
+    module = sys.modules["pages.downloads"]
+    monkeypatch.setattr(module, "DOWNLOAD_ACCEL_PREFIX", "/published/")
+    response = client.get("/download/volumetric-map/0")
+    assert response.status_code == 200
+    assert response.data == b""
+    assert (
+        response.headers["X-Accel-Redirect"]
+        == "/published/volumetric-map/S1-12/S1-12proteomics.xlsx"
+    )
+
+    # the internal location does not depend on the working directory
+    monkeypatch.chdir("/")
+    response = client.get("/download/volumetric-map/0")
+    assert (
+        response.headers["X-Accel-Redirect"]
+        == "/published/volumetric-map/S1-12/S1-12proteomics.xlsx"
+    )
@@ -1,3 +1,4 @@
+import io
 import json
 
 import dash
@@ -5,13 +6,24 @@ import dash_bootstrap_components as dbc
 import plotly
 from dash import dcc, html
 from PIL import Image
+import numpy as np
 import os
+import shutil
 import sys
+from pathlib import Path
 
 if os.getcwd() not in sys.path:
     sys.path.append(os.getcwd())
 import app
-from pages.ocpage import make_tab_content, update_pic
+from pages.ocpage import (
+    composite_channels,
+    layout,
+    make_tab_content,
+    update_composite,
+    update_pic,
+    update_slice_urls,
+    update_tile_source,
+)
 from pages.constants import FILE_DESTINATION as FD
 
 
@@ -115,11 +127,12 @@ def test_update_pic():
         "width": 600,
     }
     # no tab, no slider
-    pic = Image.open(f"{FD["sci-images"]}/S1-1/S1-1-1/S1-1-1_C00000.png")
+    pic = Path(f"{FD["sci-images"]}/S1-1/S1-1-1/S1-1-1_C00000.png")
     test1 = update_pic(None, False, data)
     assert isinstance(test1, dash._callback.NoUpdate)
     case2 = html.Img(
-        src=pic,
+        id="si-slice-img",
+        src=f"/assets/config/scientific-images/S1-1/S1-1-1/S1-1-1_C00000.png?v={pic.stat().st_mtime_ns}",
         className="custom-slicer-img solo-slicer-img",
         style={"max-height": data["height"], "max-width": data["width"]},
     )
@@ -142,9 +155,10 @@ def test_update_pic():
     }
 
     # tab and slider
-    pic2 = Image.open(f"{FD["sci-images"]}/S1-7/S1-7-1/S1-7-1_C00000.png")
+    pic2 = Path(f"{FD["sci-images"]}/S1-7/S1-7-1/S1-7-1_C00000.png")
     case3 = html.Img(
-        src=pic2,
+        id="si-slice-img",
+        src=f"/assets/config/scientific-images/S1-7/S1-7-1/S1-7-1_C00000.png?v={pic2.stat().st_mtime_ns}",
         className="custom-slicer-img solo-slicer-img",
         style={"max-height": data["height"], "max-width": data["width"]},
     )
@@ -152,3 +166,159 @@ def test_update_pic():
     test3 = update_pic("channel-1", 1, data)
     test3j = json.loads(json.dumps(test3, cls=plotly.utils.PlotlyJSONEncoder))
     assert case3j == test3j
+
+    # display copies written at publish are preferred
+    display = Path(f"{FD["sci-images"]}/S1-7/S1-7-1/display")
+    display.mkdir()
+    try:
+        Image.open(pic2).save(display / "S1-7-1_C00000.webp")
+        test4 = update_pic("channel-1", 1, data)
+        assert test4.src.startswith(
+            "/assets/config/scientific-images/S1-7/S1-7-1/display/S1-7-1_C00000.webp?v="
+        )
+
+        # no pixels pass through the callback, the browser fetches the image and may cache it
+        client = app.server.test_client()
+        response = client.get(test4.src)
+        assert response.status_code == 200
+        assert response.mimetype == "image/webp"
+        assert response.cache_control.max_age == 31536000
+        unversioned = client.get(test4.src.split("?")[0])
+        assert unversioned.cache_control.max_age is None
+    finally:
+        shutil.rmtree(display)
+
+
+def test_update_tile_source():
+    data = {
+        "block": "S1-7",
+        "iset": "S1-7-1",
+        "cat": "Optical Clearing",
+        "file": "S1-7-1.tif",
+        "basefile": "S1-7-1",
+        "slices": "10",
+        "channels": "2",
+        "height": 500,
+        "width": 1000,
+    }
+    assert update_tile_source(None, None, data) is dash.no_update
+    assert update_tile_source("channel-2", 11, data) is None
+    # the zoomable view is only offered for image sets with tile pyramids
+    page = json.dumps(layout(iset="S1-7-1"), cls=plotly.utils.PlotlyJSONEncoder)
+    assert "tile-switch" not in page
+
+    tiles = Path(f"{FD["sci-images"]}/S1-7/S1-7-1/tiles")
+    tiles.mkdir()
+    try:
+        # the first slice has no pyramid
+        (tiles / "S1-7-1_C10002.dzi").write_text("<Image/>")
+        source = update_tile_source("channel-2", 3, data)
+        assert source["type"] == "dzi"
+        assert source["url"].startswith(
+            "/assets/config/scientific-images/S1-7/S1-7-1/tiles/S1-7-1_C10002.dzi?v="
+        )
+        assert source["prefix"].endswith("/images/")
+        assert source["script"].endswith("/openseadragon.min.js")
+        page = json.dumps(layout(iset="S1-7-1"), cls=plotly.utils.PlotlyJSONEncoder)
+        assert "tile-switch" in page
+
+        # slices without a pyramid are shown as a single image
+        source = update_tile_source("channel-1", 1, data)
+        assert source["type"] == "image"
+        assert source["url"].startswith(
+            "/assets/config/scientific-images/S1-7/S1-7-1/S1-7-1_C00000.png?v="
+        )
+    finally:
+        shutil.rmtree(tiles)
+
+
+def test_update_slice_urls():
+    data = {
+        "block": "S1-7",
+        "iset": "S1-7-1",
+        "cat": "Optical Clearing",
+        "file": "S1-7-1.tif",
+        "basefile": "S1-7-1",
+        "slices": "10",
+        "channels": "2",
+        "height": 500,
+        "width": 1000,
+    }
+    slices = update_slice_urls("channel-2", data)
+    assert len(slices["urls"]) == 10
+    assert slices["urls"][3].startswith(
+        "/assets/config/scientific-images/S1-7/S1-7-1/S1-7-1_C10003.png"
+    )
+    assert slices["urls"][3] == update_pic("channel-2", 4, data).src
+    assert slices["prefetch"] == 5
+    assert slices["cache"] == 50
+
+    # nothing to prefetch for a single image
+    data["slices"] = "1"
+    assert update_slice_urls("channel-1", data) is dash.no_update
+
+
+def test_composite_channels():
+    channels = np.array([[[0, 100, 255]], [[255, 100, 0]]], dtype=np.uint8)
+    pixels = composite_channels(channels, ["#ff0000", "#00ff00"], [1, 0.5])
+    assert pixels.dtype == np.uint8
+    assert pixels.shape == (1, 3, 3)
+    assert pixels[0].tolist() == [[0, 127, 0], [100, 50, 0], [255, 0, 0]]
+    # channels that add up past the maximum are clipped
+    pixels = composite_channels(channels, ["#ffffff", "#ffffff"], [1, 2])
+    assert pixels[0, :, 0].tolist() == [255, 255, 255]
+
+
+def test_update_composite():
+    data = {
+        "block": "S1-7",
+        "iset": "S1-7-1",
+        "cat": "Optical Clearing",
+        "file": "S1-7-1.tif",
+        "basefile": "S1-7-1",
+        "slices": "10",
+        "channels": "2",
+        "height": 500,
+        "width": 1000,
+    }
+    page = json.dumps(layout(iset="S1-7-1"), cls=plotly.utils.PlotlyJSONEncoder)
+    assert "composite-switch" in page
+
+    src, style = update_composite(
+        False, 3, [True, True], ["#ff0000", "#00ff00"], [1, 1], data
+    )
+    assert style == {"display": "none"}
+    src, style = update_composite(
+        True, 3, [False, True], ["#ff0000", "#00ff00"], [1, 0.5], data
+    )
+    assert style == {"display": "flex"}
+    assert src.startswith(
+        "/scientific-images-composite/S1-7-1/3?c=1&color=00ff00&gain=0.5&v="
+    )
+
+    # served by a blueprint registered in app.py, not as a side effect of importing the page
+    assert "composites.composite_image" in app.server.view_functions
+    client = app.server.test_client()
+    response = client.get(src)
+    assert response.status_code == 200
+    assert response.mimetype == "image/jpeg"
+    assert response.cache_control.max_age == 31536000
+    composite = Image.open(io.BytesIO(response.data))
+    assert (
+        composite.size
+        == Image.open(f"{FD["sci-images"]}/S1-7/S1-7-1/S1-7-1_C10002.png").size
+    )
+
+    response = client.get(
+        "/scientific-images-composite/S1-7-1/3?c=0,1&color=ff0000,0000ff&gain=1,1"
+    )
+    assert response.status_code == 200
+    assert "max-age" not in response.headers.get("Cache-Control", "")
+    # channels, slices, and image sets that do not exist
+    for url in [
+        "/scientific-images-composite/S1-7-1/3?c=2&color=ff0000&gain=1",
+        "/scientific-images-composite/S1-7-1/11?c=0&color=ff0000&gain=1",
+        "/scientific-images-composite/S1-7-9/3?c=0&color=ff0000&gain=1",
+        "/scientific-images-composite/S1-7-1/3?c=0,1&color=ff0000&gain=1",
+    ]:
+        assert client.get(url).status_code == 404
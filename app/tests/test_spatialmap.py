@@ -1,3 +1,5 @@
+import base64
+import json
 import pandas as pd
 import numpy as np
 import pytest
@@ -7,6 +9,9 @@ import sys
 if os.getcwd() not in sys.path:
     sys.path.append(os.getcwd())
 import app
+from dash import no_update
+from dash._callback_context import context_value
+from dash._utils import AttributeDict
 from pages.spatialmap import (
     make_defaults,
     make_axes,
@@ -14,11 +19,35 @@ from pages.spatialmap import (
     load_image_layers,
     load_data,
     update_fig,
+    render_fig,
+    figure_cache,
+    figure_key,
+    style_paths,
+    restyle_fig,
     make_image_layers,
     get_colorscale,
     get_all_images,
+    get_points_data,
+    read_table,
+    read_images,
+    table_file,
+    dataset_cache,
+    DatasetCache,
 )
-from pages.ui import make_image_layer_fig
+from pages.ui import (
+    make_image_layer_fig,
+    make_cube_vertices,
+    VoxelGrid,
+    lod_factor,
+    pool_sum,
+    encode_figure,
+    gen_cube_triangles,
+    make_sphere_fig,
+    make_sphere_template,
+    CUBE_TRIANGLES,
+)
+from pages.constants import FILE_DESTINATION as FD
+from components import tables
 
 D_PROTEIN = "CYB5A"
 D_SCHEME = "jet"
@@ -751,7 +780,7 @@ def test_uf_sphere_layer():
         block="S1-12",
     )
     assert fig1["data"][0]["z"].min() == 11.0
-    assert fig1["data"][0]["z"].max() == 39.0
+    assert fig1["data"][0]["z"].max() == 189.0
     assert fig2["data"][0]["z"].min() == 161.0
     assert fig2["data"][0]["z"].max() == 189.0
 
@@ -797,9 +826,37 @@ def test_uf_sphere_category():
         block="S1-12",
     )
 
-    assert len(fig1["data"]) == 165
-    assert len(fig2["data"]) == 39
-    assert len(fig3["data"]) == 126
+    # all spheres are drawn in one trace
+    vertices, triangles = make_sphere_template(14)
+    assert len(fig1["data"]) == 1
+    assert len(fig1["data"][0]["intensity"]) == 165 * vertices.shape[0]
+    assert len(fig2["data"][0]["intensity"]) == 39 * vertices.shape[0]
+    assert len(fig3["data"][0]["intensity"]) == 126 * vertices.shape[0]
+
+
+def test_make_sphere_fig_modes():
+    df = get_points_data("S1-12")
+    grid = VoxelGrid.from_points(df, axes)
+    mesh_fig = make_sphere_fig(
+        axes, (-3, 1), cat_opts, grid, value=D_PROTEIN, mode="mesh"
+    )
+    marker_fig = make_sphere_fig(
+        axes, (-3, 1), cat_opts, grid, value=D_PROTEIN, mode="markers"
+    )
+    values = df[D_PROTEIN].dropna()
+    vertices, triangles = make_sphere_template(14)
+
+    assert vertices.shape == (29, 3)
+    assert triangles.shape == (54, 3)
+    assert mesh_fig["data"][0]["type"] == "mesh3d"
+    assert len(mesh_fig["data"][0]["i"]) == len(values) * 54
+    assert (
+        np.array_equal(mesh_fig["data"][0]["intensity"][:: vertices.shape[0]], values)
+        is True
+    )
+    assert marker_fig["data"][0]["type"] == "scatter3d"
+    assert np.array_equal(marker_fig["data"][0]["marker"]["color"], values) is True
+    assert marker_fig["data"][0]["marker"]["cmin"] == -3
 
 
 def test_uo_protein():
@@ -820,3 +877,369 @@ def test_uo_protein():
 
     assert min(fig1["data"][0]["intensity"]) == value_info["ALB"]["Min"]
     assert max(fig1["data"][0]["intensity"]) == value_info["ALB"]["Max"]
+
+
+def test_dataset_cache(tmp_path):
+    cache = DatasetCache(max_bytes=10000)
+    file = tmp_path / "data.csv"
+    file.write_text("a,b\n1,2\n")
+
+    df1 = cache.get(("test", "A"), [file], lambda: pd.read_csv(file))
+    df2 = cache.get(("test", "A"), [file], lambda: pd.read_csv(file))
+    assert df1 is df2
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+    # a republished file must be reloaded
+    file.write_text("a,b\n1,2\n3,4\n")
+    df3 = cache.get(("test", "A"), [file], lambda: pd.read_csv(file))
+    assert df3.shape == (2, 2)
+    assert cache.stats()["misses"] == 2
+    assert cache.stats()["entries"] == 1
+
+    # least recently used entries are evicted once the budget is exceeded
+    big = np.zeros(1000)
+    cache.get(("test", "B"), [file], lambda: big)
+    cache.get(("test", "C"), [file], lambda: big)
+    assert cache.stats()["bytes"] <= 10000
+    assert cache.stats()["evictions"] >= 1
+    assert ("test", "B") not in cache.entries
+
+    with pytest.raises(FileNotFoundError):
+        cache.get(("test", "D"), [tmp_path / "missing.csv"], lambda: None)
+
+
+def test_get_points_data():
+    dataset_cache.clear()
+    hits = dataset_cache.stats()["hits"]
+    df1 = get_points_data("S1-12")
+    df2 = get_points_data("S1-12")
+    assert df1 is df2
+    assert df1.shape[0] == 180
+    assert dataset_cache.stats()["hits"] == hits + 1
+
+
+def test_read_table(tmp_path):
+    csv = tmp_path / "points_data.csv"
+    npy = tmp_path / "points_data.npy"
+    df = pd.DataFrame(
+        data={
+            "Block ID": [1, 2, 3],
+            "X Center": [25.0, 75.0, 125.0],
+            "Category": [True, np.nan, False],
+            "Note": ["a", np.nan, "b"],
+            "CYB5A": [-2.0121, np.nan, 0.5],
+        }
+    )
+    df.to_csv(csv, index=False)
+    tables.write_columnar(df, npy)
+
+    pd.testing.assert_frame_equal(read_table(npy), read_table(csv))
+    # a blank category cell is not in the category, whichever file the grid is built from
+    axes = {"X": [0, 50, 100, 150], "Y": [0, 50], "Z": [0, 50]}
+    for file in [csv, npy]:
+        points = read_table(file).drop(columns="Note")
+        points = points.assign(**{"Y Center": 25.0, "Z Center": 25.0})
+        grid = VoxelGrid.from_points(points, axes)
+        assert grid.category[0, 0].tolist() == [True, False, False]
+
+
+def test_table_file(tmp_path, monkeypatch):
+    monkeypatch.setitem(FD, "volumetric-map", str(tmp_path))
+    loc = tmp_path / "S1-12"
+    loc.mkdir()
+    csv = loc / "points_data.csv"
+    npy = loc / "points_data.npy"
+    df = pd.DataFrame(data={"X Center": [25.0, 75.0]})
+    df.to_csv(csv, index=False)
+    assert table_file("S1-12", "points_data") == csv
+
+    tables.write_columnar(df, npy)
+    tables.write_manifest(npy, csv)
+    # the binary copy is used whatever order the files were published in
+    os.utime(npy, ns=(0, 0))
+    assert table_file("S1-12", "points_data") == npy
+
+    # binary copies written with an older layout are not used
+    manifest = json.loads(tables.manifest_file(npy).read_text())
+    tables.manifest_file(npy).write_text(json.dumps({**manifest, "format": 1}))
+    assert table_file("S1-12", "points_data") == csv
+    tables.write_manifest(npy, csv)
+
+    # a CSV replaced by hand is read instead of the binary copy
+    pd.DataFrame(data={"X Center": [25.0, 75.0, 125.0]}).to_csv(csv, index=False)
+    assert table_file("S1-12", "points_data") == csv
+
+
+def test_read_images(tmp_path):
+    img = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    np.savetxt(tmp_path / "L0.txt", img, delimiter="\t", fmt="%.3f")
+    np.save(tmp_path / "L1.npy", img)
+
+    imgs = read_images([tmp_path / "L0.txt", tmp_path / "L1.npy"])
+    assert np.array_equal(imgs[0], img) is True
+    assert np.array_equal(imgs[1], img) is True
+    assert imgs[1].dtype == np.uint8
+
+
+def test_make_cube_vertices():
+    centers = np.array([[25.0, 25.0, 25.0], [25.0, 25.0, 75.0]])
+    vertices = make_cube_vertices(centers, np.array([50, 50, 50]))
+    low, high = 0.0, 49.999
+    expected = [
+        [low, low, low],
+        [high, low, low],
+        [low, high, low],
+        [high, high, low],
+        [low, low, high],
+        [high, low, high],
+        [low, high, high],
+        [high, high, high],
+    ]
+    assert vertices.shape == (16, 3)
+    assert np.allclose(vertices[:8], expected)
+    assert np.allclose(vertices[8:], np.array(expected) + [0, 0, 50])
+
+
+def test_gen_cube_triangles():
+    df = pd.DataFrame(data={"X Center": np.zeros(24)})
+    expected = []
+    for m in range(0, 24, 8):
+        expected.extend([[m + x[0], m + x[1], m + x[2]] for x in CUBE_TRIANGLES])
+
+    faces = gen_cube_triangles(df)
+    assert faces.shape == (3, 36)
+    assert np.array_equal(faces, np.transpose(np.array(expected))) is True
+    # the same array is reused for the same number of cubes
+    assert gen_cube_triangles(df) is faces
+
+
+def test_voxel_grid():
+    df = get_points_data("S1-12")
+    grid = VoxelGrid.from_points(df, axes)
+    assert grid.shape == (4, 5, 9)
+    assert grid.occupied.sum() == df.shape[0]
+    assert grid.category.sum() == df["Category"].sum()
+    assert set(grid.values.keys()) == set(value_info.keys())
+    for row in df.sample(n=20, random_state=0).itertuples():
+        z = int(row[4] // 50)
+        y = int(row[3] // 50)
+        x = int(row[2] // 50)
+        assert np.allclose(
+            grid.values[D_PROTEIN][z, y, x], getattr(row, D_PROTEIN), equal_nan=True
+        )
+
+    # cells are returned in the same order as the points data
+    centers, values = grid.points(grid.select(), D_PROTEIN)
+    assert np.array_equal(
+        centers, df[["X Center", "Y Center", "Z Center"]].to_numpy(dtype=float)
+    )
+    assert np.allclose(values, df[D_PROTEIN], equal_nan=True)
+
+    mask = grid.select("Layer 2", cat_opts["Label (Only True)"], cat_opts)
+    selected = df[(df["Z Center"] == 75) & df["Category"]]
+    assert mask.sum() == selected.shape[0]
+    assert not mask[[0, 2, 3]].any()
+
+
+def test_render_fig():
+    figure_cache.clear()
+    args = [
+        "layer-tab",
+        D_SCHEME,
+        D_PROTEIN,
+        D_OPACITY,
+        D_OPACITY,
+        "Layer 2",
+        "All",
+        1,
+        "All",
+        cat_opts,
+        value_info,
+        axes,
+        "S1-12",
+        False,
+    ]
+    key = figure_key("S1-12", *args)
+    assert figure_cache.get(key) is None
+
+    fig1, style1 = render_fig(*args)
+    assert figure_cache.get(key) is not None
+    fig2, style2 = render_fig(*args)
+    assert fig1 == fig2
+    assert style1 == style2
+    assert fig2["data"][0]["name"] == "Layer 2"
+    assert style2["paths"]["color"] == [[0, "colorscale"]]
+    assert style2["figure"] == [
+        "layer-tab",
+        D_PROTEIN,
+        "Layer 2",
+        "All",
+        "All",
+        "S1-12",
+        False,
+    ]
+
+    # other settings are cached separately
+    assert figure_key("S1-12", *args[:5], "Layer 3", *args[6:]) != key
+
+
+def test_style_paths():
+    cube_data = [{"type": "mesh3d"}, {"type": "surface"}, {"type": "surface"}]
+    assert style_paths("cube-image-tab", cube_data) == {
+        "color": [[0, "colorscale"]],
+        "cubeopacity": [[0, "opacity"]],
+        "pointopacity": [],
+        "image_opacity": [],
+    }
+    layer_paths = style_paths("layer-tab", [{"type": "surface"}] * 4)
+    assert layer_paths["color"] == [[i, "colorscale"] for i in range(4)]
+    sphere_paths = style_paths("sphere-tab", [{"type": "scatter3d"}])
+    assert sphere_paths["color"] == [[0, "marker", "colorscale"]]
+    image_paths = style_paths("image-layer-tab", [{"type": "surface"}] * 2)
+    assert image_paths["image_opacity"] == [[0, "opacity"], [1, "opacity"]]
+    assert image_paths["color"] == []
+
+
+def test_restyle_fig():
+    shown = ["cube-tab", D_PROTEIN, "All", "All", "All", "S1-12", False]
+    style = {
+        "figure": shown,
+        "paths": style_paths("cube-tab", [{"type": "mesh3d"}]),
+    }
+    context_value.set(
+        AttributeDict(**{"triggered_inputs": [{"prop_id": "color-store-sm.data"}]})
+    )
+    patch = restyle_fig("inferno", 0.4, 0.1, 1, style, *shown)
+    operations = patch.to_plotly_json()["operations"]
+    assert len(operations) == 1
+    assert operations[0]["location"] == ["data", 0, "colorscale"]
+    assert operations[0]["params"]["value"][0] == [0.0, "#000004"]
+
+    context_value.set(
+        AttributeDict(
+            **{"triggered_inputs": [{"prop_id": "image-opacity-store-sm.data"}]}
+        )
+    )
+    assert restyle_fig("inferno", 0.4, 0.1, 1, style, *shown) is no_update
+
+    # the figure for another layer or tab is being drawn, so its traces are not patched
+    context_value.set(
+        AttributeDict(**{"triggered_inputs": [{"prop_id": "color-store-sm.data"}]})
+    )
+    other_layer = ["cube-tab", D_PROTEIN, "Layer 2", "All", "All", "S1-12", False]
+    assert restyle_fig("inferno", 0.4, 0.1, 1, style, *other_layer) is no_update
+    other_tab = ["layer-tab", *shown[1:]]
+    assert restyle_fig("inferno", 0.4, 0.1, 1, style, *other_tab) is no_update
+
+
+def test_voxel_grid_downsample():
+    grid = VoxelGrid.from_points(get_points_data("S1-12"), axes)
+    coarse = grid.downsample(2)
+    assert coarse.shape == (2, 3, 5)
+    assert coarse.axes["X"] == [0, 100, 200, 300, 400, 450]
+    assert coarse.axes["Z"] == [0, 100, 200]
+    assert coarse.occupied.all()
+
+    block = grid.values[D_PROTEIN][0:2, 0:2, 0:2]
+    assert np.isclose(coarse.values[D_PROTEIN][0, 0, 0], np.nanmean(block))
+    # cells at the far edge of the grid cover fewer cells of the original grid
+    assert np.array_equal(coarse.widths["X"], [100, 100, 100, 100, 50]) is True
+    centers, values = coarse.points(coarse.select(), D_PROTEIN)
+    assert centers[-1].tolist() == [425, 225, 150]
+
+
+def test_lod_factor():
+    grid = VoxelGrid.from_points(get_points_data("S1-12"), axes)
+    assert lod_factor(grid, 8, 8 * 180) == 1
+    assert lod_factor(grid, 8, 8 * 179) == 2
+    assert lod_factor(grid, 1, 30, dense=True) == 2
+    assert lod_factor(grid, 1, 29, dense=True) == 3
+    assert lod_factor(grid, 8, 0) == 9
+
+    # the same factors as counting the cells of each downsampled grid
+    rng = np.random.default_rng(0)
+    occupied = rng.random((13, 7, 10)) < 0.3
+    grid = VoxelGrid(grid.axes, occupied, occupied, {})
+    for max_vertices in range(0, occupied.sum() + 2, 7):
+        factor = 1
+        while (
+            factor < 13 and np.count_nonzero(pool_sum(occupied, factor)) > max_vertices
+        ):
+            factor += 1
+        assert lod_factor(grid, 1, max_vertices) == factor
+
+
+def test_uf_lod(monkeypatch):
+    monkeypatch.setattr(
+        sys.modules[update_fig.__module__], "VOLUMETRIC_MAP_MAX_VERTICES", 8 * 100
+    )
+    settings = dict(
+        color=D_SCHEME,
+        value=D_PROTEIN,
+        category_data=cat_opts,
+        value_range_dict=value_info,
+        axes=axes,
+        block="S1-12",
+    )
+    fig1 = update_fig("cube-tab", layer="All", **settings)
+    fig2 = update_fig("cube-tab", layer="All", full_resolution=True, **settings)
+    fig3 = update_fig("cube-tab", layer="Layer 2", **settings)
+    fig4 = update_fig("point-tab", layer="All", **settings)
+
+    assert len(fig1["data"][0]["x"]) == 30 * 8
+    assert "Reduced detail" in fig1["layout"]["title"]["text"]
+    assert len(fig2["data"][0]["x"]) == 180 * 8
+    assert fig2["layout"]["title"]["text"] is None
+    assert len(fig3["data"][0]["x"]) == 45 * 8
+    assert len(fig4["data"][0]["x"]) == 180
+
+
+def decode_typed_array(spec: dict) -> np.ndarray:
+    array = np.frombuffer(base64.b64decode(spec["bdata"]), dtype=spec["dtype"])
+    if "shape" in spec:
+        array = array.reshape([int(size) for size in spec["shape"].split(",")])
+    return array
+
+
+def test_encode_figure():
+    fig = update_fig(
+        "cube-tab",
+        value=D_PROTEIN,
+        category_data=cat_opts,
+        value_range_dict=value_info,
+        axes=axes,
+        block="S1-12",
+    )
+    encoded = json.loads(encode_figure(fig))
+    trace = encoded["data"][0]
+    # 1440 vertices fit in uint16 face indices
+    assert trace["i"]["dtype"] == "u2"
+    assert trace["x"]["dtype"] == "f4"
+    assert np.array_equal(decode_typed_array(trace["i"]), fig["data"][0]["i"]) is True
+    assert np.allclose(decode_typed_array(trace["x"]), fig["data"][0]["x"])
+    assert np.allclose(
+        decode_typed_array(trace["intensity"]),
+        fig["data"][0]["intensity"],
+        equal_nan=True,
+    )
+    assert trace["colorscale"] == json.loads(fig.to_json())["data"][0]["colorscale"]
+
+    # coordinates on the axis grid are sent as whole numbers, and 2D arrays keep their shape
+    fig = update_fig(
+        "layer-tab",
+        value=D_PROTEIN,
+        category_data=cat_opts,
+        value_range_dict=value_info,
+        axes=axes,
+        block="S1-12",
+    )
+    trace = json.loads(encode_figure(fig))["data"][0]
+    assert trace["x"]["dtype"] == "u2"
+    assert np.array_equal(decode_typed_array(trace["x"]), fig["data"][0]["x"]) is True
+    assert trace["surfacecolor"]["shape"] == "5, 9"
+    assert np.allclose(
+        decode_typed_array(trace["surfacecolor"]),
+        fig["data"][0]["surfacecolor"],
+        equal_nan=True,
+    )
@@ -0,0 +1,98 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+# Copying published files between volumes may not keep sub-second modification times
+MTIME_TOLERANCE_NS = 10**9
+# layout of the binary tables, binary copies written with an older layout are not used
+TABLE_FORMAT = 2
+# suffix of the field that records which cells of a column were blank
+MISSING_SUFFIX = ":missing"
+
+
+def missing_field(column: str) -> str:
+    return f"{column}{MISSING_SUFFIX}"
+
+
+def write_columnar(df: pd.DataFrame, loc: Path):
+    """Saves a DataFrame as a NumPy structured array with one typed field per column, so that the display app can
+    memory-map the data instead of parsing CSV text. Text columns are stored as fixed-width unicode, with missing
+    values stored as empty strings. True/false columns with blank cells are stored as bool, with a mask field of the
+    blank cells."""
+    names = []
+    arrays = []
+    for column in df.columns:
+        values = df[column]
+        if values.dtype != bool and pd.api.types.infer_dtype(values) == "boolean":
+            names += [str(column), missing_field(column)]
+            arrays += [
+                values.to_numpy(dtype=bool, na_value=False),
+                values.isna().to_numpy(),
+            ]
+        elif values.dtype == "object":
+            names.append(str(column))
+            arrays.append(values.fillna("").astype(str).to_numpy(dtype=str))
+        else:
+            names.append(str(column))
+            arrays.append(values.to_numpy())
+    records = np.rec.fromarrays(arrays, names=names)
+    np.save(loc, records, allow_pickle=False)
+
+
+def read_columnar(file: Path) -> pd.DataFrame:
+    """Reads a table saved by write_columnar, with missing values as NaN like pd.read_csv gives them"""
+    records = np.load(file, mmap_mode="r", allow_pickle=False)
+    names = records.dtype.names
+    columns = {}
+    for name in names:
+        if name.endswith(MISSING_SUFFIX):
+            continue
+        values = np.asarray(records[name])
+        if values.dtype.kind == "U":
+            missing = values == ""
+        elif missing_field(name) in names:
+            missing = np.asarray(records[missing_field(name)])
+        else:
+            columns[name] = values
+            continue
+        values = values.astype(object)
+        values[missing] = np.nan
+        columns[name] = values
+    return pd.DataFrame(columns)
+
+
+def manifest_file(npy: Path) -> Path:
+    return Path(npy).with_suffix(".json")
+
+
+def write_manifest(npy: Path, csv: Path):
+    """Records the size and modification time of the CSV a binary table was written from, so the display app can tell
+    whether the binary copy still matches the CSV once both have been published."""
+    stat = Path(csv).stat()
+    with open(manifest_file(npy), "w") as f:
+        json.dump(
+            {
+                "format": TABLE_FORMAT,
+                "csv_size": stat.st_size,
+                "csv_mtime_ns": stat.st_mtime_ns,
+            },
+            f,
+        )
+
+
+def binary_is_current(npy: Path, csv: Path) -> bool:
+    """Returns True if the binary table exists and was written from the CSV as it is now, False if the CSV has been
+    replaced since, or the binary copy has no manifest or an older layout."""
+    try:
+        with open(manifest_file(npy)) as f:
+            manifest = json.load(f)
+        stat = Path(csv).stat()
+        Path(npy).stat()
+    except (FileNotFoundError, ValueError):
+        return False
+    return (
+        manifest.get("format") == TABLE_FORMAT
+        and manifest.get("csv_size") == stat.st_size
+        and abs(manifest.get("csv_mtime_ns", 0) - stat.st_mtime_ns) < MTIME_TOLERANCE_NS
+    )
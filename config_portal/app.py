@@ -22,6 +22,7 @@ from flask_login import (
 )
 from dotenv import load_dotenv
 from config_components import ui
+from config_components.uploads import uploads
 from components import header
 
 load_dotenv()
@@ -75,6 +76,8 @@ login_manager.init_app(server)
 login_manager.login_view = "/login"
 login_manager.session_protection = "strong"
 
+server.register_blueprint(uploads)
+
 
 class User(UserMixin):
     def __init__(self, username):
@@ -0,0 +1,87 @@
+// bytes sent in each request of a chunked upload
+const UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024;
+// attempts to resume an upload after the connection drops before giving up
+const UPLOAD_RETRIES = 5;
+
+async function uploadOffset(url) {
+    const response = await fetch(url);
+    const result = await response.json();
+    if (!response.ok) {
+        throw new Error(result.message);
+    }
+    return result.offset;
+}
+
+// Sends a file to the upload endpoint in chunks, starting from whatever the server has already received.
+// Resolves to the result of validating the assembled file.
+async function uploadFile(uploadUrl, file, onProgress) {
+    const params = new URLSearchParams({ name: file.name, size: file.size });
+    const url = `${uploadUrl}?${params}`;
+    let offset = await uploadOffset(url);
+    let retries = 0;
+    while (true) {
+        onProgress(offset);
+        let response;
+        try {
+            response = await fetch(`${url}&offset=${offset}`, {
+                method: "PUT",
+                body: file.slice(offset, offset + UPLOAD_CHUNK_SIZE),
+            });
+        } catch (err) {
+            // the connection dropped, so ask the server how much arrived and carry on from there
+            if (++retries > UPLOAD_RETRIES) {
+                throw err;
+            }
+            await new Promise((resolve) => setTimeout(resolve, 1000 * retries));
+            offset = await uploadOffset(url);
+            continue;
+        }
+        const result = await response.json();
+        if (response.status === 409) {
+            offset = result.offset;
+            continue;
+        }
+        if (!response.ok) {
+            return { success: false, message: result.message };
+        }
+        retries = 0;
+        offset = result.offset;
+        if ("success" in result) {
+            onProgress(offset);
+            return result;
+        }
+    }
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    uploads: {
+        // Uploads the files chosen in a section's large file picker one after another, showing overall progress
+        uploadFiles: async function (n_clicks, id) {
+            const input = document.getElementById(`${id.section}-chunked-input`);
+            const files = Array.from(input.files);
+            if (!n_clicks || files.length === 0) {
+                return window.dash_clientside.no_update;
+            }
+            // the downloads catalog must be in the depot before the files it lists
+            files.sort((a, b) => (b.name === "downloads.xlsx") - (a.name === "downloads.xlsx"));
+            const progressId = `${id.section}-chunked-progress`;
+            const total = files.reduce((sum, file) => sum + file.size, 0);
+            let done = 0;
+            const results = [];
+            for (const file of files) {
+                let result;
+                try {
+                    result = await uploadFile(input.dataset.uploadUrl, file, (offset) => {
+                        const value = Math.round((100 * (done + offset)) / total);
+                        dash_clientside.set_props(progressId, { value: value, label: `${value}%` });
+                    });
+                } catch (err) {
+                    result = { success: false, message: `${file.name} could not be uploaded: ${err.message}` };
+                }
+                results.push({ name: file.name, success: result.success, message: result.message });
+                done += file.size;
+            }
+            return results;
+        },
+    },
+});
@@ -1,4 +1,4 @@
-from dash import html, dcc
+from dash import html, dcc, get_relative_path
 import dash_bootstrap_components as dbc
 
 PUBLISH_BUTTONS = [
@@ -115,6 +115,43 @@ def make_upload(prefix, max_size, allow_multiple=False):
     ]
 
 
+def make_chunked_upload(prefix):
+    """Makes a file picker that sends large files to the upload endpoint in chunks, so they
+    don't need to fit in a single request and can resume after a dropped connection."""
+    return [
+        dbc.Row(
+            [
+                dbc.Col(
+                    html.Label("Large files", htmlFor=f"{prefix}-chunked-input"),
+                    width="auto",
+                ),
+                dbc.Col(
+                    # Dash has no file input that leaves the files unread, so a plain one is rendered for the
+                    # upload script, which sends the files to the URL under the app's path prefix
+                    dcc.Markdown(
+                        f'<input id="{prefix}-chunked-input" type="file" multiple class="form-control" '
+                        f'data-upload-url="{get_relative_path(f"/upload/{prefix}")}">',
+                        dangerously_allow_html=True,
+                        className="chunked-input",
+                    )
+                ),
+                dbc.Col(
+                    dbc.Button(
+                        "Upload",
+                        id={"type": "chunked-upload-button", "section": prefix},
+                        color="primary",
+                    ),
+                    width="auto",
+                ),
+            ],
+            align="center",
+            class_name="upload-row",
+        ),
+        dbc.Progress(id=f"{prefix}-chunked-progress", value=0, class_name="mb-3"),
+        dcc.Store(id={"type": "chunked-upload-result", "section": prefix}),
+    ]
+
+
 def make_upload_card(
     header,
     dl_notes,
@@ -126,6 +163,7 @@ def make_upload_card(
     accordion=False,
     acc_notes=None,
     upload_multiple=False,
+    chunked=False,
 ):
     body_items = []
     if accordion:
@@ -172,6 +210,8 @@ def make_upload_card(
                 make_upload(prefix, max_size), align="center", class_name="upload-row"
             )
         )
+    if chunked:
+        body_items.extend(make_chunked_upload(prefix))
     return dbc.Card(
         [
             dbc.CardHeader(html.H4(header, className="upload-card-title")),
@@ -0,0 +1,119 @@
+import fcntl
+import hashlib
+import logging
+import os
+import time
+from pathlib import Path
+from flask import Blueprint, abort, jsonify, make_response, request
+from flask_login import current_user
+from config_components import validate
+from pages.constants import FILE_DESTINATION as FD
+
+app_logger = logging.getLogger(__name__)
+gunicorn_logger = logging.getLogger("gunicorn.error")
+app_logger.handlers = gunicorn_logger.handlers
+app_logger.setLevel(gunicorn_logger.level)
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 50 * 1024**3))
+# seconds an unfinished upload is kept before its partial file is removed
+UPLOAD_EXPIRY = int(os.getenv("UPLOAD_EXPIRY", 24 * 60 * 60))
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# file type and processing function for each upload card that accepts chunked uploads
+UPLOAD_SECTIONS = {
+    "sci-images": ("image", validate.process_sci_image),
+    "volumetric-map": ("excel/vol", validate.process_volumetric_map_data),
+    "obj-files": ("3d", validate.process_obj_files),
+}
+
+uploads = Blueprint("uploads", __name__, url_prefix="/upload")
+
+
+def upload_error(status: int, message: str, **fields):
+    """Stops the request with a JSON error the upload script can show to the user"""
+    abort(make_response(jsonify(message=message, **fields), status))
+
+
+def get_upload(section: str) -> tuple[Path, str, int]:
+    """Checks the upload request and finds the partial file it is assembled in. The same user
+    uploading the same file again gets the same partial file, so an interrupted upload can resume.
+    Returns (partial file path, filename, file size)"""
+    if not current_user.is_authenticated:
+        upload_error(401, "You must log in to upload files")
+    if section not in UPLOAD_SECTIONS:
+        upload_error(404, f"Files can't be uploaded to {section}")
+    filename = request.args.get("name", "")
+    is_valid = validate.is_valid_filename(fn=filename)
+    if not filename or Path(filename).name != filename or not is_valid[0]:
+        upload_error(400, is_valid[1] or f"Invalid filename {filename}")
+    try:
+        size = int(request.args["size"])
+    except (KeyError, ValueError):
+        upload_error(400, "File size missing")
+    if not 0 < size <= MAX_UPLOAD_SIZE:
+        upload_error(400, f"{filename} is empty or larger than {MAX_UPLOAD_SIZE} bytes")
+    key = f"{current_user.id}/{section}/{filename}/{size}"
+    name = hashlib.sha1(key.encode()).hexdigest()
+    return Path(FD["uploads"]["depot"]) / f"{name}.part", filename, size
+
+
+def remove_stale_uploads():
+    """Removes partial files of uploads that were abandoned more than UPLOAD_EXPIRY seconds ago"""
+    p = Path(FD["uploads"]["depot"])
+    if not p.exists():
+        return
+    cutoff = time.time() - UPLOAD_EXPIRY
+    for part in p.glob("*.part"):
+        try:
+            if part.stat().st_mtime < cutoff:
+                part.unlink()
+                app_logger.debug(f"Removed stale upload {part.name}")
+        except FileNotFoundError:
+            pass
+
+
+@uploads.get("/<section>")
+def upload_offset(section: str):
+    """Returns how many bytes of the file have been received, which is where the upload resumes"""
+    part, filename, size = get_upload(section)
+    remove_stale_uploads()
+    offset = part.stat().st_size if part.exists() else 0
+    return jsonify(offset=offset)
+
+
+@uploads.put("/<section>")
+def upload_chunk(section: str):
+    """Appends the request body to the partial file at the given offset, streaming it to disk.
+    Once the whole file is received, it is validated and saved to the depot by the same function
+    the upload card uses."""
+    part, filename, size = get_upload(section)
+    try:
+        offset = int(request.args["offset"])
+    except (KeyError, ValueError):
+        upload_error(400, "Chunk offset missing")
+    part.parent.mkdir(parents=True, exist_ok=True)
+    with open(part, "ab") as f:
+        # one request at a time appends to a partial file
+        fcntl.flock(f, fcntl.LOCK_EX)
+        received = os.fstat(f.fileno()).st_size
+        if offset != received:
+            upload_error(409, "Chunk offset does not match the upload", offset=received)
+        while block := request.stream.read(STREAM_BLOCK_SIZE):
+            if received + len(block) > size:
+                f.truncate(offset)
+                upload_error(400, f"{filename} is larger than its declared size")
+            f.write(block)
+            received += len(block)
+    if received < size:
+        return jsonify(offset=received)
+
+    filetype, which_function = UPLOAD_SECTIONS[section]
+    try:
+        result = validate.process_file(
+            part, filename, filetype, which_function, filename
+        )
+    finally:
+        # the file was moved to the depot if it was accepted
+        part.unlink(missing_ok=True)
+    app_logger.debug(f"Chunked upload of {filename} to {section}: {result}")
+    return jsonify(offset=received, success=result[0], message=result[1])
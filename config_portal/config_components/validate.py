@@ -4,6 +4,7 @@ import pandas as pd
 import nh3
 import magic
 from pathlib import Path
+import math
 import os
 import re
 import shutil
@@ -13,15 +14,28 @@ import logging
 import base64
 from collections.abc import Callable
 from pages.constants import FILE_DESTINATION as FD
+from components import tables
 import cv2
 import numpy as np
+from pywavefront import Wavefront
 
 
 MAX_TITLE_LENGTH = 2048
 MAX_FILENAME_LENGTH = 255
 FINAL_THUMBNAIL_SIZE = (220, 110)
 THUMBNAIL_TILE = (110, 110)
+# the image viewer shows copies of scientific images in this format (webp or jpg), no larger than this size
+DISPLAY_IMAGE_FORMAT = os.getenv("DISPLAY_IMAGE_FORMAT", "webp")
+DISPLAY_IMAGE_SIZE = (int(os.getenv("DISPLAY_IMAGE_SIZE", 1200)),) * 2
+# edge length of the tiles of the zoomable image pyramids
+TILE_SIZE = int(os.getenv("TILE_SIZE", 256))
+# bytes read from the start of an uploaded file to check its type
+FILE_TYPE_HEADER_SIZE = 65536
 NAMEREG = r"\.\w{3,8}"  # regex to check file name format
+# face counts of the simplified levels of detail published for each 3D model, from most to least detailed
+MESH_LOD_FACES = [
+    int(faces) for faces in os.getenv("MESH_LOD_FACES", "100000,20000").split(",")
+]
 VALID_EXTS = {
     "excel": ["xls", "xlsx"],
     "excel/vol": ["xls", "xlsx", "stl", "nrrd", "vti", "obj", "mtl"],
@@ -244,12 +258,14 @@ def update_links(column, df):
             i += 1
 
 
-def open_excel_from_bytes(file: bytes, worksheet=None) -> pd.DataFrame:
-    """Reads an Excel spreadsheet. Returns a dict of DataFrames if no worksheets are
-    provided, returns one Dataframe if a worksheet is provided."""
+def open_excel_from_bytes(file: bytes | Path, worksheet=None) -> pd.DataFrame:
+    """Reads an Excel spreadsheet from bytes or a file path. Returns a dict of DataFrames if no
+    worksheets are provided, returns one Dataframe if a worksheet is provided."""
+    if isinstance(file, bytes):
+        file = io.BytesIO(file)
     try:
         dfs = pd.read_excel(
-            io.BytesIO(file), sheet_name=worksheet, engine="calamine", na_values=[" "]
+            file, sheet_name=worksheet, engine="calamine", na_values=[" "]
         )
         return True, "", dfs
     except ValueError:
@@ -409,7 +425,7 @@ def get_image_info(
     return (valid_name[0], valid_name[1], new_df, "")
 
 
-def process_sci_image(file: bytes, filename: str) -> tuple[bool, str, str]:
+def process_sci_image(file: bytes | Path, filename: str) -> tuple[bool, str, str]:
     """This function is called when a user uploads files to the scientific images upload widget.
     It checks that image metadata exists and the image name conforms to naming conventions, then
     saves the image to the depot.
@@ -425,13 +441,7 @@ def process_sci_image(file: bytes, filename: str) -> tuple[bool, str, str]:
     name_matches = check_image_name(filename, df)
     if not name_matches[0]:
         return False, name_matches[2]
-    dest = Path(FD["sci-images"]["depot"])
-    if not Path.exists(dest):
-        Path.mkdir(dest, parents=True)
-    with open(os.path.join(FD["sci-images"]["depot"], filename), "wb") as fp:
-        fp.write(file)
-
-    return True, ""
+    return save_generic_file(FD["sci-images"]["depot"], file, filename)
 
 
 def update_title(value: str) -> tuple[str, str, str]:
@@ -588,6 +598,105 @@ def collect_pngs_for_thumbnail(dest: str) -> list:
     return display_imgs
 
 
+def to_display_mode(img: Image.Image) -> Image.Image:
+    """Converts an image to a mode that can be saved as DISPLAY_IMAGE_FORMAT"""
+    if img.mode in ("I", "I;16", "F"):
+        # scale 16 bit and float images to 8 bits
+        pixels = np.asarray(img, dtype=np.float32)
+        pixels = pixels * 255 / max(pixels.max(), 1)
+        img = Image.fromarray(pixels.astype(np.uint8))
+    elif img.mode not in ("L", "RGB", "RGBA"):
+        img = img.convert("RGBA")
+    if img.mode == "RGBA" and DISPLAY_IMAGE_FORMAT == "jpg":
+        img = img.convert("RGB")
+    return img
+
+
+def write_display_image(img_file: Path) -> Path:
+    """
+    Saves a copy of a scientific image that fits within DISPLAY_IMAGE_SIZE in the display folder next to it, so that
+    the image viewer can link to a small file instead of sending the original.
+    """
+    display_file = (
+        img_file.parent / "display" / f"{img_file.stem}.{DISPLAY_IMAGE_FORMAT}"
+    )
+    display_file.parent.mkdir(parents=True, exist_ok=True)
+    with Image.open(img_file) as img:
+        img = to_display_mode(img)
+        img.thumbnail(DISPLAY_IMAGE_SIZE)
+        img.save(display_file, quality=85)
+    return display_file
+
+
+def write_image_pyramid(img_file: Path) -> Path:
+    """
+    Saves a Deep Zoom pyramid of a scientific image in the tiles folder next to it: a .dzi descriptor, and a _files
+    folder with a level for each halving of the image's size, cut into TILE_SIZE tiles. The image viewer's zoomable
+    view only fetches the tiles it shows, whatever the size of the original.
+    """
+    tiles_dir = img_file.parent / "tiles"
+    files_dir = tiles_dir / f"{img_file.stem}_files"
+    if files_dir.exists():
+        shutil.rmtree(files_dir)
+    with Image.open(img_file) as img:
+        level_img = to_display_mode(img)
+        width, height = level_img.size
+        # level 0 is a single pixel, the last level is the full image
+        max_level = math.ceil(math.log2(max(width, height, 1)))
+        for level in range(max_level, -1, -1):
+            level_dir = files_dir / str(level)
+            level_dir.mkdir(parents=True)
+            level_width, level_height = level_img.size
+            for col in range(math.ceil(level_width / TILE_SIZE)):
+                for row in range(math.ceil(level_height / TILE_SIZE)):
+                    box = (
+                        col * TILE_SIZE,
+                        row * TILE_SIZE,
+                        min((col + 1) * TILE_SIZE, level_width),
+                        min((row + 1) * TILE_SIZE, level_height),
+                    )
+                    level_img.crop(box).save(
+                        level_dir / f"{col}_{row}.{DISPLAY_IMAGE_FORMAT}", quality=85
+                    )
+            level_img = level_img.reduce(2)
+
+    dzi_file = tiles_dir / f"{img_file.stem}.dzi"
+    dzi_file.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" '
+        f'Format="{DISPLAY_IMAGE_FORMAT}" Overlap="0" TileSize="{TILE_SIZE}">'
+        f'<Size Width="{width}" Height="{height}"/></Image>\n'
+    )
+    return dzi_file
+
+
+def write_display_images(dest: str):
+    """Writes a display copy and a tile pyramid of each viewer image in dest that does not have up to date ones"""
+    p = Path(dest)
+    if not p.exists():
+        return
+    for file in p.iterdir():
+        if not file.is_file():
+            continue
+        if file.suffix == ".png":
+            if not check_png_name_ending(file.name, file.name.split("_C"))[0]:
+                continue
+        elif file.suffix != ".jpg":
+            continue
+        outputs = {
+            write_display_image: p / "display" / f"{file.stem}.{DISPLAY_IMAGE_FORMAT}",
+            write_image_pyramid: p / "tiles" / f"{file.stem}.dzi",
+        }
+        for write, output in outputs.items():
+            if output.exists() and output.stat().st_mtime_ns >= file.stat().st_mtime_ns:
+                continue
+            try:
+                write(file)
+            except Exception:
+                # the image viewer falls back to the original image
+                app_logger.debug(traceback.print_exc())
+
+
 def generate_thumbnail(
     dest: str, img_set: str, thumbnail_loc: str
 ) -> tuple[bool, bool, str]:
@@ -628,6 +737,8 @@ def generate_thumbnails(
     """
     # Track list of thumbnails that have been processed
     processed_thumbnails = []
+    # folders that need display copies once all of their images have been moved
+    dest_dirs = []
 
     # This will form a df that will be used to update the thumbnails catalog
     new_td = {"Block": [], "Preview": [], "Name": [], "Link": []}
@@ -659,6 +770,8 @@ def generate_thumbnails(
                 app_logger.debug(traceback.print_exc())
                 return ("Image not published", f"{err}", "failure")
         # check if a thumbnail has been generated for this image
+        if dest_dir not in dest_dirs:
+            dest_dirs.append(dest_dir)
         if match_info[1] not in processed_thumbnails:
             thumbnail_loc = (
                 f"{FD['thumbnails']['publish']}/{img_set}/{match_info[1]}_thumbnail.png"
@@ -679,6 +792,9 @@ def generate_thumbnails(
             # mark this thumbnail as processed
             processed_thumbnails.append(match_info[1])
 
+    for dest_dir in dest_dirs:
+        write_display_images(dest_dir)
+
     # update thumbnail catalog
     new_tr = pd.DataFrame(data=new_td)
     update_thumbnails_record(new_tr)
@@ -770,6 +886,25 @@ def process_content(
         return False, is_valid_type[1]
 
 
+def process_file(
+    path: Path, filename: str, filetype: str, which_function: Callable, param=None
+) -> tuple[bool, str]:
+    """For a file assembled on disk by a chunked upload, checks the file type for validity from
+    the start of the file and runs the given file processing function on the file's path.
+    Returns (success, error message)"""
+    with open(path, "rb") as f:
+        header = f.read(FILE_TYPE_HEADER_SIZE)
+    is_valid_type = check_file_type(header, filetype, filename)
+    if is_valid_type[0]:
+        is_processed = which_function(path, param)
+        if not is_processed[0]:
+            return False, is_processed[1]
+        else:
+            return True, ""
+    else:
+        return False, is_valid_type[1]
+
+
 def is_valid_filename(*args, fn="") -> bool:
     """Returns a boolean: True if the name conforms to rules, False if it is over the max
     length or contains forbidden characters."""
@@ -888,79 +1023,6 @@ def get_volumetric_map_folder(filename: str, catalog_loc: str):
     return True, block.iloc[0]
 
 
-def make_cubes_df(
-    points_df: pd.DataFrame, vol_measurements: pd.DataFrame
-) -> pd.DataFrame:
-    """For each point representing the center of a rectangular prism, calculates eight points representing
-    its vertices."""
-    # Vertices are ordered as follows:
-    # [
-    #     [x, y, z],
-    #     [x + x_dist, y, z],
-    #     [x, y + y_dist, z],
-    #     [x + x_dist, y + y_dist, z],
-    #     [x, y, z + z_dist],
-    #     [x + x_dist, y, z + z_dist],
-    #     [x, y + y_dist, z + z_dist],
-    #     [x + x_dist, y + y_dist, z + z_dist],
-    # ]
-
-    x_transform = vol_measurements.loc[0, "X Size"] / 2
-    y_transform = vol_measurements.loc[0, "Y Size"] / 2
-    z_transform = vol_measurements.loc[0, "Z Size"] / 2
-
-    transform = {
-        "x": [
-            -x_transform,
-            x_transform - 0.001,
-            -x_transform,
-            x_transform - 0.001,
-            -x_transform,
-            x_transform - 0.001,
-            -x_transform,
-            x_transform - 0.001,
-        ],
-        "y": [
-            -y_transform,
-            -y_transform,
-            y_transform - 0.001,
-            y_transform - 0.001,
-            -y_transform,
-            -y_transform,
-            y_transform - 0.001,
-            y_transform - 0.001,
-        ],
-        "z": [
-            -z_transform,
-            -z_transform,
-            -z_transform,
-            -z_transform,
-            z_transform - 0.001,
-            z_transform - 0.001,
-            z_transform - 0.001,
-            z_transform - 0.001,
-        ],
-    }
-    cubes_df = pd.DataFrame(columns=points_df.columns).astype(dtype=points_df.dtypes)
-
-    # for each row in the source df, make 8 rows in the new df. Each row represents a vertex of a rectangular
-    # prism around the provided point
-    for i in points_df.index:
-        new_x = [points_df.at[i, "X Center"] + x for x in transform["x"]]
-        new_y = [points_df.at[i, "Y Center"] + y for y in transform["y"]]
-        new_z = [points_df.at[i, "Z Center"] + z for z in transform["z"]]
-        for j in range(8):
-            idx = j + (i * 8)
-            cubes_df = pd.concat(
-                [cubes_df, points_df.loc[i].to_frame().T], ignore_index=True
-            )
-            cubes_df.at[idx, "X Center"] = new_x[j]
-            cubes_df.at[idx, "Y Center"] = new_y[j]
-            cubes_df.at[idx, "Z Center"] = new_z[j]
-    cubes_df = cubes_df.astype(dtype=points_df.dtypes)
-    return cubes_df
-
-
 def check_volumetric_map_data_xlsx(file: bytes) -> tuple[bool, str]:
     header_check = check_excel_headers(file, "volumetric-map")
     if header_check[0]:
@@ -976,15 +1038,14 @@ def check_volumetric_map_data_xlsx(file: bytes) -> tuple[bool, str]:
                 # data must be sorted for Dash to display it correctly
                 item.sort_values(by=["X Center", "Y Center", "Z Center"], inplace=True)
             item.to_csv(f"{loc}/{key}.csv", index=False)
-        # create cubes csv
+            if key == "points_data":
+                # the manifest ties the binary copy to the CSV it was written from
+                tables.write_columnar(item, f"{loc}/{key}.npy")
+                tables.write_manifest(f"{loc}/{key}.npy", f"{loc}/{key}.csv")
         if (
             header_check[2]["points_data"].size > 0
             and header_check[2]["vol_measurements"].size > 0
         ):
-            cubes_df = make_cubes_df(
-                header_check[2]["points_data"], header_check[2]["vol_measurements"]
-            )
-            cubes_df.to_csv(f"{loc}/cube_data.csv", index=False)
             return True, ""
         else:
             return (
@@ -995,16 +1056,21 @@ def check_volumetric_map_data_xlsx(file: bytes) -> tuple[bool, str]:
         return False, header_check[1]
 
 
-def save_generic_file(loc: str, file: bytes, filename: str) -> tuple[bool, str]:
+def save_generic_file(loc: str, file: bytes | Path, filename: str) -> tuple[bool, str]:
+    """Writes uploaded bytes to the depot, or moves a file assembled on disk by a chunked
+    upload there without reading it into memory."""
     dest = Path(loc)
     if not Path.exists(dest):
         Path.mkdir(dest, parents=True)
+    if isinstance(file, Path):
+        shutil.move(file, f"{loc}/{filename}")
+        return True, ""
     with open(f"{loc}/{filename}", "wb") as f:
         f.write(file)
     return True, ""
 
 
-def process_volumetric_map_data(file: bytes, filename: str) -> tuple[bool, str]:
+def process_volumetric_map_data(file: bytes | Path, filename: str) -> tuple[bool, str]:
     """Takes a file, checks the headers if metadata file, and saves them file to the depot.
     Overwrites file if it already exists.
     Returns (success, error message)"""
@@ -1051,7 +1117,7 @@ def process_volumetric_map_data(file: bytes, filename: str) -> tuple[bool, str]:
             return False, str(err)
 
 
-def process_image_layer_data(file: bytes, filename: str) -> tuple[bool, str]:
+def process_image_layer_data(file: bytes | Path, filename: str) -> tuple[bool, str]:
     p = Path(FD["image-layer"]["depot"])
     if not Path.exists(p):
         Path.mkdir(p, parents=True)
@@ -1132,16 +1198,17 @@ def publish_image_layer_data() -> tuple[str, str, str]:
                     # create greyscale image array
                     img_arr = convert_img_to_greyscale_array(img, (width, height))
                     # put it in temp dir
-                    np.savetxt(
-                        f"{temp_str}/{img.name[:-4]}.txt",
-                        img_arr,
-                        delimiter="\t",
-                        fmt="%.3f",
+                    np.save(
+                        f"{temp_str}/{img.name[:-4]}.npy",
+                        img_arr.astype(np.uint8),
+                        allow_pickle=False,
                     )
                 # move the files to publish dir
-                move_dir(
-                    temp_path, f"{FD["image-layer"]["publish"]}/{file.name}/layers"
-                )
+                layers_dest = f"{FD["image-layer"]["publish"]}/{file.name}/layers"
+                for layer in temp_path.iterdir():
+                    # remove text layers published before layers were stored as .npy
+                    Path(f"{layers_dest}/{layer.stem}.txt").unlink(missing_ok=True)
+                move_dir(temp_path, layers_dest)
                 # delete temp dir
                 shutil.rmtree(temp_path)
                 # delete original images
@@ -1221,7 +1288,7 @@ def publish_volumetric_map_data() -> tuple[str, str, str]:
     )
 
 
-def process_obj_files(file: bytes, filename: str) -> tuple[bool, str]:
+def process_obj_files(file: bytes | Path, filename: str) -> tuple[bool, str]:
     p = Path(FD["obj-files"]["volumes"]["depot"])
     if not Path.exists(p):
         Path.mkdir(p, parents=True)
@@ -1245,6 +1312,96 @@ def process_obj_files(file: bytes, filename: str) -> tuple[bool, str]:
             return False, f"{err}"
 
 
+def cluster_vertices(
+    vertices: np.ndarray, faces: np.ndarray, cell_size: float
+) -> tuple[np.ndarray, np.ndarray]:
+    """Merges the vertices in each cell of a grid into their mean and removes the faces that collapse"""
+    coords = vertices[:, :3]
+    cells = np.floor((coords - coords.min(axis=0)) / cell_size).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+    _, inverse = np.unique(keys, return_inverse=True)
+
+    counts = np.bincount(inverse)
+    merged = np.stack(
+        [
+            np.bincount(inverse, weights=vertices[:, col]) / counts
+            for col in range(vertices.shape[1])
+        ],
+        axis=1,
+    )
+
+    new_faces = inverse[faces]
+    distinct = (
+        (new_faces[:, 0] != new_faces[:, 1])
+        & (new_faces[:, 1] != new_faces[:, 2])
+        & (new_faces[:, 0] != new_faces[:, 2])
+    )
+    new_faces = new_faces[distinct]
+    # remove faces that now repeat another face, keeping the winding of the first
+    _, first = np.unique(np.sort(new_faces, axis=1), axis=0, return_index=True)
+    new_faces = new_faces[np.sort(first)]
+    return merged, new_faces
+
+
+def decimate_mesh(
+    vertices: np.ndarray, faces: np.ndarray, target_faces: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Simplifies a triangle mesh to at most target_faces faces by vertex clustering. The grid is made coarser until the
+    simplified mesh is small enough. Returns the mesh unchanged if it is already small enough.
+    """
+    if faces.shape[0] <= target_faces:
+        return vertices, faces
+    extent = np.ptp(vertices[:, :3], axis=0).max()
+    # the number of faces on a surface grows with the square of the grid resolution
+    resolution = max(2, int(np.sqrt(target_faces)))
+    while True:
+        new_vertices, new_faces = cluster_vertices(vertices, faces, extent / resolution)
+        if new_faces.shape[0] <= target_faces or resolution == 2:
+            return new_vertices, new_faces
+        resolution = max(2, int(resolution * 0.8))
+
+
+def write_mesh_file(obj_file: Path) -> Path:
+    """Saves the vertices of an obj file as float32 and its faces as uint32 in an .npz file next to it, so that the
+    display app does not have to parse the obj file. Simplified levels of detail are saved alongside as vertices_1,
+    faces_1, and so on, for each MESH_LOD_FACES that is smaller than the mesh."""
+    organ = Wavefront(str(obj_file), collect_faces=True)
+    vertices = np.array(organ.vertices, dtype=np.float32)
+    faces = np.array(organ.mesh_list[0].faces, dtype=np.uint32)
+    arrays = {"vertices": vertices, "faces": faces}
+
+    level = 1
+    for target_faces in sorted(MESH_LOD_FACES, reverse=True):
+        if target_faces >= faces.shape[0]:
+            continue
+        vertices, faces = decimate_mesh(vertices, faces, target_faces)
+        arrays[f"vertices_{level}"] = vertices.astype(np.float32)
+        arrays[f"faces_{level}"] = faces.astype(np.uint32)
+        level += 1
+
+    mesh_file = obj_file.with_suffix(".npz")
+    np.savez(mesh_file, **arrays)
+    return mesh_file
+
+
+def write_mesh_files(loc: str):
+    """Writes an .npz mesh file for each obj file in loc that does not have an up to date one"""
+    for obj_file in Path(loc).glob("*.obj"):
+        mesh_file = obj_file.with_suffix(".npz")
+        if (
+            mesh_file.exists()
+            and mesh_file.stat().st_mtime_ns >= obj_file.stat().st_mtime_ns
+        ):
+            continue
+        try:
+            write_mesh_file(obj_file)
+        except Exception:
+            # the display app falls back to parsing the obj file
+            app_logger.debug(traceback.print_exc())
+
+
 def publish_obj_files():
     """Publishes 3D model files.
     Returns (title of update toast, description of update, success status)"""
@@ -1253,6 +1410,7 @@ def publish_obj_files():
         p = Path(FD["obj-files"]["volumes"]["depot"])
         if Path.exists(p):
             move_dir(p, FD["obj-files"]["volumes"]["publish"])
+        write_mesh_files(FD["obj-files"]["volumes"]["publish"])
         # update volume entries
         publish_entries(
             f"{FD['obj-files']['summary']['depot']}/obj-files.csv",
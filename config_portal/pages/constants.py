@@ -35,4 +35,5 @@ FILE_DESTINATION = {
     },
     "title": {"depot": "./config/labels.csv", "publish": "/config/labels.csv"},
     "reports": {"depot": "./depot/reports.csv", "publish": "/config/reports.csv"},
+    "uploads": {"depot": "./depot/uploads"},
 }
@@ -5,7 +5,10 @@ from dash import (
     Output,
     Input,
     State,
+    MATCH,
+    ClientsideFunction,
     callback,
+    clientside_callback,
     no_update,
     ctx,
 )
@@ -235,6 +238,7 @@ def layout(**kwargs):
                             accordion=True,
                             acc_notes=sci_images_acc_notes,
                             upload_multiple=True,
+                            chunked=True,
                         ),
                         dcc.Loading(html.Div(id="output-sci-images-upload")),
                     ],
@@ -253,6 +257,7 @@ def layout(**kwargs):
                             accordion=True,
                             acc_notes=volumetric_map_data_acc_notes,
                             upload_multiple=True,
+                            chunked=True,
                         ),
                         dcc.Loading(html.Div(id="output-volumetric-map-upload")),
                     ],
@@ -292,6 +297,7 @@ def layout(**kwargs):
                             accordion=True,
                             acc_notes=model_files_acc_notes,
                             upload_multiple=True,
+                            chunked=True,
                         ),
                     ],
                     id="obj-files",
@@ -312,6 +318,30 @@ def layout(**kwargs):
         )
 
 
+# Chunked uploads of large files, sent by assets/chunkedUpload.js
+clientside_callback(
+    ClientsideFunction(namespace="uploads", function_name="uploadFiles"),
+    Output({"type": "chunked-upload-result", "section": MATCH}, "data"),
+    Input({"type": "chunked-upload-button", "section": MATCH}, "n_clicks"),
+    State({"type": "chunked-upload-button", "section": MATCH}, "id"),
+    prevent_initial_call=True,
+)
+
+
+def chunked_upload_toast(results: list, noun: str):
+    """Makes the upload toast for the results of a chunked upload, reporting the first failure"""
+    if not results:
+        return no_update
+    for result in results:
+        if not result["success"]:
+            return alerts.send_toast(
+                f"{noun} not uploaded", result["message"], "failure"
+            )
+    return alerts.send_toast(
+        f"{noun} uploaded", "The files were uploaded successfully.", "success"
+    )
+
+
 # Scientific images metadata
 @callback(
     Output("si-block-0-example-dl", "data"),
@@ -412,6 +442,15 @@ def upload_volumetric_map(list_of_contents, filenames):
             )
 
 
+@callback(
+    Output("output-volumetric-map-upload", "children", allow_duplicate=True),
+    Input({"type": "chunked-upload-result", "section": "volumetric-map"}, "data"),
+    prevent_initial_call=True,
+)
+def upload_volumetric_map_chunked(results):
+    return chunked_upload_toast(results, "Volumetric map data")
+
+
 @callback(
     Output("image-layers-0-example-dl", "data"),
     Input("image-layers-0-example", "n_clicks"),
@@ -492,6 +531,15 @@ def upload_sci_images(list_of_contents, filenames):
         )
 
 
+@callback(
+    Output("output-sci-images-upload", "children", allow_duplicate=True),
+    Input({"type": "chunked-upload-result", "section": "sci-images"}, "data"),
+    prevent_initial_call=True,
+)
+def upload_sci_images_chunked(results):
+    return chunked_upload_toast(results, "Images")
+
+
 # 3D Models
 @callback(
     Output("obj-files-0-example-dl", "data"),
@@ -544,6 +592,15 @@ def update_obj_files_output(list_of_contents, filenames):
         )
 
 
+@callback(
+    Output("output-obj-files-upload", "children", allow_duplicate=True),
+    Input({"type": "chunked-upload-result", "section": "obj-files"}, "data"),
+    prevent_initial_call=True,
+)
+def upload_obj_files_chunked(results):
+    return chunked_upload_toast(results, "Model files")
+
+
 @callback(
     Output("reports-0-example-dl", "data"),
     Input("reports-0-example", "n_clicks"),
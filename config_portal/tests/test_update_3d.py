@@ -1,6 +1,7 @@
 import os
 import sys
 import pandas as pd
+import numpy as np
 import json
 import plotly
 import shutil
@@ -198,3 +199,40 @@ def test_publish_obj_files():
         ).exists()
         is True
     )
+
+    mesh_file = Path(
+        f"{FD["obj-files"]["volumes"]["publish"]}/S1_Sphere_Lower_S1-1.npz"
+    )
+    assert mesh_file.exists() is True
+    with np.load(mesh_file) as mesh:
+        assert mesh["vertices"].dtype == np.float32
+        assert mesh["vertices"].shape == (8, 3)
+        assert mesh["faces"].dtype == np.uint32
+        assert mesh["faces"].shape == (12, 3)
+        assert "faces_1" not in mesh.files
+
+
+def test_decimate_mesh(monkeypatch, tmp_path):
+    obj_file = tmp_path / "sphere.obj"
+    shutil.copy("/home/nonroot/app/examples/sphere.obj", obj_file)
+    monkeypatch.setattr(validate, "MESH_LOD_FACES", [500, 100])
+    validate.write_mesh_file(obj_file)
+
+    with np.load(tmp_path / "sphere.npz") as mesh:
+        assert mesh["faces"].shape == (960, 3)
+        previous = mesh["faces"].shape[0]
+        for level in [1, 2]:
+            vertices = mesh[f"vertices_{level}"]
+            faces = mesh[f"faces_{level}"]
+            assert vertices.dtype == np.float32
+            assert faces.dtype == np.uint32
+            assert 0 < faces.shape[0] < previous
+            assert faces.max() < vertices.shape[0]
+            # every face is a triangle of distinct vertices
+            assert (faces[:, 0] != faces[:, 1]).all()
+            assert (faces[:, 1] != faces[:, 2]).all()
+            # simplified vertices stay within the bounds of the original mesh
+            assert np.abs(vertices).max() <= np.abs(mesh["vertices"]).max() + 1e-5
+            previous = faces.shape[0]
+        assert mesh["faces_1"].shape[0] <= 500
+        assert mesh["faces_2"].shape[0] <= 100
@@ -114,3 +114,20 @@ def test_move_sci_image():
 
     files = [file for file in demo_dest.iterdir() if file.is_file()]
     assert f"{FD["sci-images"]["depot"]}/S1-14-1.tif" not in files
+
+
+def test_publish_sci_images_display_copies():
+    # publish every slice of an image set from the depot
+    dest = Path(f"{FD["sci-images"]["publish"]}/S1-1/S1-1-1")
+    shutil.rmtree(dest / "display", ignore_errors=True)
+    shutil.rmtree(dest / "tiles", ignore_errors=True)
+    images = sorted(file.name for file in dest.glob("*.png"))
+    for name in images:
+        shutil.move(dest / name, f"{FD["sci-images"]["depot"]}/{name}")
+
+    assert validate.publish_sci_images()[2] == "success"
+    assert sorted(file.name for file in dest.glob("*.png")) == images
+    for name in images:
+        stem = Path(name).stem
+        assert (dest / "display" / f"{stem}.webp").exists() is True
+        assert (dest / "tiles" / f"{stem}.dzi").exists() is True
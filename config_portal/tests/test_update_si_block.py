@@ -5,6 +5,8 @@ from pathlib import Path
 import shutil
 import plotly
 import json
+import numpy as np
+from PIL import Image
 
 if os.getcwd() not in sys.path:
     sys.path.append(os.getcwd())
@@ -436,3 +438,41 @@ def test_query_thumbnails_for_changed_filenames():
 
     # reset thumbnails to original set
     tn_df_original.to_csv(FD["thumbnails"]["catalog"], index=False)
+
+
+def test_write_display_images(tmp_path):
+    src = Path(f"{FD['sci-images']['publish']}/S1-1/S1-1-1")
+    for file in src.glob("*.png"):
+        shutil.copy(file, tmp_path / file.name)
+    # a large 16 bit image and a file the viewer does not show
+    pixels = np.linspace(0, 4000, 3000 * 2000).reshape(2000, 3000).astype(np.uint16)
+    Image.fromarray(pixels).save(tmp_path / "S1-1-1_C10000.png")
+    Image.fromarray(pixels).save(tmp_path / "notes.png")
+
+    validate.write_display_images(str(tmp_path))
+    display = tmp_path / "display"
+    assert (display / "S1-1-1_C00000.webp").exists() is True
+    assert (display / "notes.webp").exists() is False
+    with Image.open(display / "S1-1-1_C10000.webp") as img:
+        assert img.format == "WEBP"
+        assert img.size == (1200, 800)
+        assert img.getextrema()[0][1] > 200
+
+    # the pyramid halves the image down to a single pixel
+    tiles = tmp_path / "tiles" / "S1-1-1_C10000_files"
+    dzi = (tmp_path / "tiles" / "S1-1-1_C10000.dzi").read_text()
+    assert 'TileSize="256"' in dzi
+    assert '<Size Width="3000" Height="2000"/>' in dzi
+    assert sorted(int(level.name) for level in tiles.iterdir()) == list(range(13))
+    assert len(list((tiles / "12").iterdir())) == 12 * 8
+    with Image.open(tiles / "12" / "11_7.webp") as tile:
+        assert tile.size == (3000 - 11 * 256, 2000 - 7 * 256)
+    with Image.open(tiles / "11" / "5_3.webp") as tile:
+        assert tile.size == (1500 - 5 * 256, 1000 - 3 * 256)
+    with Image.open(tiles / "0" / "0_0.webp") as tile:
+        assert tile.size == (1, 1)
+
+    # up to date copies are not written again
+    mtime = (display / "S1-1-1_C10000.webp").stat().st_mtime_ns
+    validate.write_display_images(str(tmp_path))
+    assert (display / "S1-1-1_C10000.webp").stat().st_mtime_ns == mtime
@@ -1,6 +1,7 @@
 import os
 import sys
 import pandas as pd
+import numpy as np
 import json
 import plotly
 from pathlib import Path
@@ -12,119 +13,75 @@ import app
 from config_components import validate
 from pages import home
 from pages.constants import FILE_DESTINATION as FD
+from components import tables
 from helpers import make_upload_content, decode_str
 
 
-def test_make_cubes_df():
-    vol_measurements = pd.DataFrame(
+def test_write_columnar(tmp_path):
+    df = pd.DataFrame(
         data={
-            "X Min": [0],
-            "X Max": [4],
-            "X Size": [2],
-            "Y Min": [0],
-            "Y Max": [4],
-            "Y Size": [2],
-            "Z Min": [0],
-            "Z Max": [4],
-            "Z Size": [2],
+            "Block ID": [1, 2, 3],
+            "X Center": [25.0, 75.0, 125.0],
+            "Category": [True, None, False],
+            "Note": ["a", None, "b"],
         }
     )
-    points_df = pd.DataFrame(
-        data={
-            "Block ID": [1, 2],
-            "X Center": [1.0, 3],
-            "Y Center": [1.0, 3],
-            "Z Center": [1.0, 3],
-            "X Size": [2, 2],
-            "Y Size": [2, 2],
-            "Z Size": [2, 2],
-            "Category": [True, False],
-            "CYB5A": [-2, 2],
-        }
+    tables.write_columnar(df, tmp_path / "points_data.npy")
+    records = np.load(tmp_path / "points_data.npy", allow_pickle=False)
+
+    assert records.dtype.names == (
+        "Block ID",
+        "X Center",
+        "Category",
+        "Category:missing",
+        "Note",
     )
-    expected_cube_df = pd.DataFrame(
-        data={
-            "Block ID": [1, 1, 1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 2, 2, 2, 2],
-            "X Center": [
-                0.0,
-                1.999,
-                0.0,
-                1.999,
-                0.0,
-                1.999,
-                0.0,
-                1.999,
-                2.0,
-                3.999,
-                2.0,
-                3.999,
-                2.0,
-                3.999,
-                2.0,
-                3.999,
-            ],
-            "Y Center": [
-                0.0,
-                0.0,
-                1.999,
-                1.999,
-                0.0,
-                0.0,
-                1.999,
-                1.999,
-                2.0,
-                2.0,
-                3.999,
-                3.999,
-                2.0,
-                2.0,
-                3.999,
-                3.999,
-            ],
-            "Z Center": [
-                0.0,
-                0.0,
-                0.0,
-                0.0,
-                1.999,
-                1.999,
-                1.999,
-                1.999,
-                2.0,
-                2.0,
-                2.0,
-                2.0,
-                3.999,
-                3.999,
-                3.999,
-                3.999,
-            ],
-            "X Size": [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-            "Y Size": [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-            "Z Size": [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-            "Category": [
-                True,
-                True,
-                True,
-                True,
-                True,
-                True,
-                True,
-                True,
-                False,
-                False,
-                False,
-                False,
-                False,
-                False,
-                False,
-                False,
-            ],
-            "CYB5A": [-2, -2, -2, -2, -2, -2, -2, -2, 2, 2, 2, 2, 2, 2, 2, 2],
-        },
+    assert records["Block ID"].dtype == "int64"
+    assert list(records["X Center"]) == [25.0, 75.0, 125.0]
+    # blank cells of a true/false column are kept apart from False
+    assert records["Category"].dtype == "bool"
+    assert list(records["Category"]) == [True, False, False]
+    assert list(records["Category:missing"]) == [False, True, False]
+    assert list(records["Note"]) == ["a", "", "b"]
+
+    table = tables.read_columnar(tmp_path / "points_data.npy")
+    assert table["Category"].tolist()[::2] == [True, False]
+    assert pd.isna(table["Category"][1])
+
+
+def test_check_volumetric_map_data_xlsx_without_cubes():
+    # the display app builds cubes from the points data, so no cube data is stored
+    loc = Path(f"{FD['volumetric-map']['meta']['depot']}/S1-12")
+    for name in ["cube_data.csv", "cube_data.npy"]:
+        Path.unlink(loc / name, missing_ok=True)
+
+    str1 = make_upload_content("/home/nonroot/app/examples/volumetric-map-data.xlsx")
+    b1 = decode_str(str1)
+    assert validate.check_volumetric_map_data_xlsx(b1) == (True, "")
+    assert (loc / "points_data.csv").exists() is True
+    assert (loc / "cube_data.csv").exists() is False
+    assert (loc / "cube_data.npy").exists() is False
+
+
+def test_publish_volumetric_map_binary_table():
+    str1 = make_upload_content("/home/nonroot/app/examples/volumetric-map-data.xlsx")
+    b1 = decode_str(str1)
+    str2 = make_upload_content("/home/nonroot/app/examples/downloads.xlsx")
+    b2 = decode_str(str2)
+    assert validate.process_volumetric_map_data(b2, "downloads.xlsx")[0] is True
+    assert validate.process_volumetric_map_data(b1, "volumetric-map-data.xlsx") == (
+        True,
+        "",
     )
-    cubes_df = validate.make_cubes_df(points_df, vol_measurements)
-    pd.testing.assert_frame_equal(cubes_df, expected_cube_df, check_dtype=True)
+    assert validate.publish_volumetric_map_data()[2] == "success"
+
+    # the display app reads the published binary copy instead of parsing the CSV
+    loc = Path(f"{FD['volumetric-map']['meta']['publish']}/S1-12")
+    csv = loc / "points_data.csv"
+    npy = loc / "points_data.npy"
+    assert tables.binary_is_current(npy, csv) is True
+    records = np.load(npy, allow_pickle=False)
+    assert records.shape[0] == pd.read_csv(csv).shape[0]
 
 
 def test_check_catalog_xlsx():
@@ -179,6 +136,9 @@ def test_process_volumetric_map_data():
     assert (
         validate.process_volumetric_map_data(b1, "volumetric-map-data.xlsx")[0] is True
     )
+    loc = f"{FD['volumetric-map']['meta']['depot']}/S1-12"
+    points = np.load(f"{loc}/points_data.npy", allow_pickle=False)
+    assert points.shape[0] == pd.read_csv(f"{loc}/points_data.csv").shape[0]
     assert validate.process_volumetric_map_data(b2, "downloads.xlsx")[0] is True
     assert validate.process_volumetric_map_data(b3, "S1-12proteomics.xlsx")[0] is True
 
@@ -335,7 +295,11 @@ def test_publish_image_layer_data():
     img_dest_path = Path(img_dest)
     assert img_dest_path.exists() is True
     img_names = [x.name for x in img_dest_path.iterdir()]
-    assert "S1-12_L0.txt" in img_names
+    assert "S1-12_L0.npy" in img_names
+    assert "S1-12_L0.txt" not in img_names
+    img = np.load(f"{img_dest}/S1-12_L0.npy")
+    assert img.dtype == np.uint8
+    assert img.shape == (250, 450)
 
     metadata_dest_path = Path(FD["image-layer"]["publish"])
     metadata_names = [y.name for y in metadata_dest_path.iterdir()]
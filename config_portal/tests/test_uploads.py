@@ -0,0 +1,103 @@
+import os
+import sys
+from pathlib import Path
+from dash import _get_paths
+from dash._utils import AttributeDict
+from flask_login.utils import _create_identifier
+
+if os.getcwd() not in sys.path:
+    sys.path.append(os.getcwd())
+
+import app
+from config_components.ui import make_chunked_upload
+from pages.constants import FILE_DESTINATION as FD
+from helpers import clean_dir
+
+BASE_URL = "https://localhost"
+
+
+def logged_in_client():
+    client = app.server.test_client()
+    # session protection ties the login to the client's address and user agent
+    with app.server.test_request_context(environ_base=client.environ_base):
+        identifier = _create_identifier()
+    with client.session_transaction(base_url=BASE_URL) as sess:
+        sess["_user_id"] = "user"
+        sess["_fresh"] = True
+        sess["_id"] = identifier
+    return client
+
+
+def upload_url(name: str, size: int, section: str = "sci-images") -> str:
+    return f"/upload/{section}?name={name}&size={size}"
+
+
+def test_chunked_upload():
+    src = Path(f"{FD["sci-images"]["publish"]}/S1-1/S1-1-1/S1-1-1_C00000.png")
+    data = src.read_bytes()
+    url = upload_url(src.name, len(data))
+    half = len(data) // 2
+
+    response = app.server.test_client().get(url, base_url=BASE_URL)
+    assert response.status_code == 401
+
+    client = logged_in_client()
+    assert client.get(url, base_url=BASE_URL).json == {"offset": 0}
+    response = client.put(f"{url}&offset=0", data=data[:half], base_url=BASE_URL)
+    assert response.json == {"offset": half}
+
+    # a chunk sent again after a dropped connection is refused with the offset to resume from
+    response = client.put(f"{url}&offset=0", data=data[:half], base_url=BASE_URL)
+    assert response.status_code == 409
+    assert response.json["offset"] == half
+    assert client.get(url, base_url=BASE_URL).json == {"offset": half}
+
+    response = client.put(f"{url}&offset={half}", data=data[half:], base_url=BASE_URL)
+    assert response.json["success"] is True
+    assert Path(f"{FD["sci-images"]["depot"]}/{src.name}").read_bytes() == data
+    assert list(Path(FD["uploads"]["depot"]).glob("*.part")) == []
+
+    cleanup_status = clean_dir(FD["sci-images"]["depot"])
+    assert cleanup_status[0] is True
+
+
+def test_chunked_upload_rejected():
+    client = logged_in_client()
+    response = client.get(upload_url("blocks.csv", 10, "reports"), base_url=BASE_URL)
+    assert response.status_code == 404
+    response = client.get(upload_url("../blocks.png", 10), base_url=BASE_URL)
+    assert response.status_code == 400
+
+    # the assembled file goes through the same checks as the upload card
+    data = Path("/home/nonroot/app/examples/images-example.xlsx").read_bytes()
+    url = upload_url("images-example.xlsx", len(data))
+    response = client.put(f"{url}&offset=0", data=data, base_url=BASE_URL)
+    assert response.json["success"] is False
+    assert list(Path(FD["uploads"]["depot"]).glob("*.part")) == []
+    assert not Path(f"{FD["sci-images"]["depot"]}/images-example.xlsx").exists()
+
+    # more data than the declared size is not kept
+    url = upload_url("S1-1-1_C00000.png", 4)
+    response = client.put(f"{url}&offset=0", data=b"12345", base_url=BASE_URL)
+    assert response.status_code == 400
+    assert client.get(url, base_url=BASE_URL).json == {"offset": 0}
+
+    cleanup_status = clean_dir(FD["uploads"]["depot"])
+    assert cleanup_status[0] is True
+
+
+def chunked_input(prefix: str) -> str:
+    return make_chunked_upload(prefix)[0].children[1].children.children
+
+
+def test_chunked_upload_url(monkeypatch):
+    assert 'data-upload-url="/upload/sci-images"' in chunked_input("sci-images")
+    response = logged_in_client().get(
+        "/upload/sci-images?name=S1-1-1_C00000.png&size=4", base_url=BASE_URL
+    )
+    assert response.json == {"offset": 0}
+
+    # behind a proxy the upload script sends files under the app's path prefix
+    config = AttributeDict(_get_paths.CONFIG, requests_pathname_prefix="/portal/")
+    monkeypatch.setattr(_get_paths, "CONFIG", config)
+    assert 'data-upload-url="/portal/upload/sci-images"' in chunked_input("sci-images")
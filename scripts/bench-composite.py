@@ -0,0 +1,92 @@
+import io
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from pathlib import Path
+from PIL import Image
+
+"""
+Times the steps of a scientific image viewer composite for 5 channel, 1000x1000 slices and checks that changing a
+channel's color or gain stays within the budget. Run from the app folder so the app's modules can be imported:
+
+    cd app && python ../scripts/bench-composite.py
+"""
+
+if os.getcwd() not in sys.path:
+    sys.path.append(os.getcwd())
+
+import app  # noqa: E402, F401
+from pages.ocpage import composite_channels, read_channel  # noqa: E402
+
+CHANNELS = 5
+SIZE = 1000
+SLICES = 10
+REPEATS = 20
+# milliseconds allowed for a color or gain change once a slice's channels are cached
+BUDGET_MS = 100
+COLORS = ["#ff0000", "#00ff00", "#0000ff", "#ff00ff", "#00ffff"]
+
+
+def make_channel(rng: np.random.Generator) -> np.ndarray:
+    """Makes a microscopy-like channel: scattered blurred spots over a noisy background"""
+    y, x = np.mgrid[0:SIZE, 0:SIZE]
+    pixels = rng.normal(20, 5, (SIZE, SIZE))
+    for cy, cx, radius in rng.uniform((0, 0, 5), (SIZE, SIZE, 40), (60, 3)):
+        pixels += 200 * np.exp(-((y - cy) ** 2 + (x - cx) ** 2) / (2 * radius**2))
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def encode(pixels: np.ndarray) -> int:
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    return buffer.tell()
+
+
+rng = np.random.default_rng(0)
+with tempfile.TemporaryDirectory() as folder:
+    files = []
+    for s in range(SLICES):
+        for c in range(CHANNELS):
+            file = Path(folder) / f"bench_C{c}{s:04}.png"
+            Image.fromarray(make_channel(rng)).save(file)
+            files.append(file)
+
+    def load(s: int) -> np.ndarray:
+        return np.stack(
+            [
+                read_channel(str(f), f.stat().st_mtime_ns)
+                for f in files[s * CHANNELS : (s + 1) * CHANNELS]
+            ]
+        )
+
+    # first view of each slice: the channel images are read and decoded
+    start = time.perf_counter()
+    for s in range(SLICES):
+        load(s)
+    first_ms = (time.perf_counter() - start) / SLICES * 1000
+
+    # color and gain changes on a slice whose channels are cached
+    blend_ms = 0
+    encode_ms = 0
+    size = 0
+    for i in range(REPEATS):
+        gains = rng.uniform(0.5, 2, CHANNELS)
+        start = time.perf_counter()
+        channels = load(i % SLICES)
+        pixels = composite_channels(channels, COLORS, gains)
+        blended = time.perf_counter()
+        size = encode(pixels)
+        blend_ms += (blended - start) * 1000
+        encode_ms += (time.perf_counter() - blended) * 1000
+    blend_ms /= REPEATS
+    encode_ms /= REPEATS
+
+print(f"{'step':>24} {'ms':>8}")
+print(f"{'read channels':>24} {first_ms:>8.1f}")
+print(f"{'blend cached channels':>24} {blend_ms:>8.1f}")
+print(f"{'encode jpeg':>24} {encode_ms:>8.1f}")
+print(f"{'per interaction':>24} {blend_ms + encode_ms:>8.1f} (budget {BUDGET_MS})")
+print(f"{'jpeg bytes':>24} {size:>8}")
+assert blend_ms + encode_ms < BUDGET_MS
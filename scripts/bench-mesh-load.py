@@ -0,0 +1,109 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+"""
+Times reading the meshes of an organ one at a time and with a thread pool, for obj files parsed with pywavefront and
+for the .npz mesh files written when models are published. Run from the app folder so the app's modules can be
+imported:
+
+    cd app && python ../scripts/bench-mesh-load.py
+"""
+
+if os.getcwd() not in sys.path:
+    sys.path.append(os.getcwd())
+
+import app  # noqa: E402, F401
+from pages.model3d import read_obj  # noqa: E402
+
+MESHES = 8
+# faces of each mesh, as a grid of quads on a sphere
+GRID = 160
+REPEATS = 3
+WORKERS = 4
+
+
+def write_sphere(file: Path, grid: int):
+    """Writes a UV sphere with 2 * grid * grid triangular faces as an obj file"""
+    theta, phi = np.meshgrid(
+        np.linspace(0, np.pi, grid + 1), np.linspace(0, 2 * np.pi, grid + 1)
+    )
+    vertices = np.stack(
+        [np.sin(theta) * np.cos(phi), np.sin(theta) * np.sin(phi), np.cos(theta)],
+        axis=-1,
+    ).reshape(-1, 3)
+    index = np.arange((grid + 1) ** 2).reshape(grid + 1, grid + 1)
+    a, b = index[:-1, :-1].ravel(), index[:-1, 1:].ravel()
+    c, d = index[1:, :-1].ravel(), index[1:, 1:].ravel()
+    faces = np.concatenate([np.stack([a, b, d], 1), np.stack([a, d, c], 1)]) + 1
+    with open(file, "w") as f:
+        f.writelines(f"v {x:.6f} {y:.6f} {z:.6f}\n" for x, y, z in vertices)
+        f.writelines(f"f {i} {j} {k}\n" for i, j, k in faces)
+
+
+def drop_page_cache() -> bool:
+    """Empties the Linux page cache so that files are read from disk. Needs root, returns False otherwise."""
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        return True
+    except OSError:
+        return False
+
+
+def best_time(read, files: list, workers: int, cold=False) -> float:
+    times = []
+    for _ in range(REPEATS):
+        if cold:
+            drop_page_cache()
+        start = time.perf_counter()
+        if workers == 1:
+            for file in files:
+                read(file)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(read, files))
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [str(Path(tmp) / f"mesh{i}.obj") for i in range(MESHES)]
+        for file in files:
+            write_sphere(Path(file), GRID)
+        vertices, faces = read_obj(files[0])
+        print(
+            f"{os.cpu_count()} CPUs, {MESHES} meshes of {faces.shape[0]} faces, "
+            f"{WORKERS} threads, best of {REPEATS}"
+        )
+
+        obj_one = best_time(read_obj, files, 1)
+        obj_threads = best_time(read_obj, files, WORKERS)
+        print(f"obj       one at a time {obj_one:.3f} s  threads {obj_threads:.3f} s")
+
+        for file in files:
+            vertices, faces = read_obj(file)
+            np.savez(
+                Path(file).with_suffix(".npz"),
+                vertices=vertices.astype(np.float32),
+                faces=faces.astype(np.uint32),
+            )
+        npz_one = best_time(read_obj, files, 1)
+        npz_threads = best_time(read_obj, files, WORKERS)
+        print(f"npz       one at a time {npz_one:.3f} s  threads {npz_threads:.3f} s")
+        if drop_page_cache():
+            npz_one = best_time(read_obj, files, 1, cold=True)
+            npz_threads = best_time(read_obj, files, WORKERS, cold=True)
+            print(
+                f"npz cold  one at a time {npz_one:.3f} s  threads {npz_threads:.3f} s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import os
+import sys
+
+"""
+Compares the size of the volumetric map figures sent to the browser as plain JSON and as base64 typed arrays, for
+every view of every published block. Run from the app folder so the app's modules and configuration can be loaded:
+
+    cd app && python ../scripts/measure-figure-payloads.py
+"""
+
+if os.getcwd() not in sys.path:
+    sys.path.append(os.getcwd())
+
+import app  # noqa: E402, F401
+from pathlib import Path  # noqa: E402
+from pages.constants import FILE_DESTINATION as FD  # noqa: E402
+from pages.spatialmap import load_data, update_fig  # noqa: E402
+from pages.ui import encode_figure  # noqa: E402
+
+TABS = ["cube-tab", "cube-image-tab", "point-tab", "layer-tab", "image-layer-tab"]
+
+print(f"{'block':>10} {'view':>16} {'json bytes':>12} {'typed bytes':>12} {'ratio':>6}")
+for block_dir in sorted(Path(FD["volumetric-map"]).iterdir()):
+    if not block_dir.is_dir():
+        continue
+    block = block_dir.name
+    page_info, defaults, layers, category_opts, value_info, axes, downloads = load_data(
+        block
+    )
+    for tab in TABS:
+        try:
+            fig = update_fig(
+                tab,
+                value=defaults["d_value"],
+                category_data=category_opts,
+                value_range_dict=value_info,
+                axes=axes,
+                block=block,
+            )
+        except FileNotFoundError:
+            # image layers are optional
+            continue
+        json_size = len(fig.to_json())
+        typed_size = len(encode_figure(fig))
+        print(
+            f"{block:>10} {tab:>16} {json_size:>12} {typed_size:>12} {typed_size / json_size:>6.2f}"
+        )